@@ -0,0 +1,120 @@
+# This file contains the asynchronous access and event log shared by the webserver and the socket interface.
+# Copyright (C) 2023  Nico Pieplow (nitrescov)
+# Contact: nitrescov@protonmail.com
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import time
+from collections import deque
+
+# Constants
+BUFFER_SIZE = 10000  # Max number of entries waiting to be written, older entries are dropped if the writer falls behind
+SAMPLE_THRESHOLD = BUFFER_SIZE * 3 // 4  # Above this fill level only every SAMPLE_RATE-th "info" entry is kept
+SAMPLE_RATE = 10
+FLUSH_INTERVAL = 0.5  # Seconds between two batched writes
+LOG_BACKUPS = 3  # Number of rotated log files that are kept (name.1 ... name.3)
+
+buffer = deque(maxlen=BUFFER_SIZE)
+counters = {"sampled": 0, "dropped": 0, "seen": 0}
+log_path = ""
+log_max_bytes = 0
+
+
+def start(path: str, max_bytes: int) -> None:
+    global log_path, log_max_bytes
+    log_path = path
+    log_max_bytes = max_bytes
+    from gevent import monkey  # A real thread: a blocking write (e.g. to a full pipe) in a greenlet would stall the whole gevent hub
+    monkey.get_original("_thread", "start_new_thread")(writer, (monkey.get_original("time", "sleep"),))
+
+
+def log(level: str = "info", **fields) -> None:
+    # Never blocks: the entry is only appended to the ring buffer (deque operations are thread-safe), the writer thread does the I/O
+    counters["seen"] += 1
+    if level == "info" and len(buffer) >= SAMPLE_THRESHOLD and counters["seen"] % SAMPLE_RATE:
+        counters["sampled"] += 1
+        return
+    if len(buffer) >= BUFFER_SIZE:
+        counters["dropped"] += 1
+    buffer.append(dict(time=round(time.time(), 3), level=level, **fields))
+
+
+def writer(sleep) -> None:
+    # The counters are only written by log(), the writer reports the difference to the last reported values instead of resetting them
+    log_file = open(log_path, "a", encoding="utf-8") if log_path else sys.stdout
+    reported = {"sampled": 0, "dropped": 0}
+    while True:
+        sleep(FLUSH_INTERVAL)
+        lines = list()
+        while buffer:
+            lines.append(json.dumps(buffer.popleft(), separators=(",", ":")))
+        sampled, dropped = counters["sampled"] - reported["sampled"], counters["dropped"] - reported["dropped"]
+        if sampled or dropped:
+            lines.append(json.dumps({"time": round(time.time(), 3), "level": "warning", "event": "overload",
+                                     "sampled": sampled, "dropped": dropped}, separators=(",", ":")))
+            reported["sampled"] += sampled
+            reported["dropped"] += dropped
+        if not lines:
+            continue
+        try:
+            log_file.write("\n".join(lines) + "\n")  # One write per batch
+            log_file.flush()
+            if log_path and log_max_bytes and log_file.tell() >= log_max_bytes:
+                log_file.close()
+                rotate()
+                log_file = open(log_path, "a", encoding="utf-8")
+        except OSError:
+            pass  # Logging must never stop the server (e.g. full disk), the batch is lost
+
+
+def rotate() -> None:
+    for number in range(LOG_BACKUPS - 1, 0, -1):
+        if os.path.isfile(f"{log_path}.{number}"):
+            os.replace(f"{log_path}.{number}", f"{log_path}.{number + 1}")
+    os.replace(log_path, f"{log_path}.1")
+
+
+class RequestLogger:
+    # WSGI middleware, that logs every request of the webserver after its response body was sent completely
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        request = {"start": time.monotonic(), "status": 0}
+
+        def logged_start_response(status, headers, exc_info=None):
+            request["status"] = int(status[:3])
+            return start_response(status, headers, exc_info) if exc_info else start_response(status, headers)
+
+        return LoggedBody(self.app(environ, logged_start_response), environ, request)
+
+
+class LoggedBody:
+    def __init__(self, body, environ, request):
+        self.body = body
+        self.environ = environ
+        self.request = request
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.body, "close"):
+            self.body.close()
+        log("error" if self.request["status"] >= 500 else "info", source="web", user=self.environ.get("raspinas.user"), method=self.environ.get("REQUEST_METHOD"),
+            route=self.environ.get("PATH_INFO"), bytes=self.sent, duration=round(time.monotonic() - self.request["start"], 4), status=self.request["status"])
@@ -0,0 +1,308 @@
+# This file contains the archive engines: parallel zip compression (skipping already compressed media) and bounded unpacking.
+# Copyright (C) 2023  Nico Pieplow (nitrescov)
+# Contact: nitrescov@protonmail.com
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import os
+import errno
+import time
+import zlib
+import shutil
+import struct
+import tarfile
+import zipfile
+import tempfile
+import secrets
+import threading
+import file_operations
+from collections import deque
+
+# Constants
+READ_CHUNK = 2**20  # Bytes read (and compressed) per step (1 MB)
+MEMORY_LIMIT = 2**20  # Compressed data up to this size is kept in RAM, larger results are buffered in a temporary file
+STORED_EXTENSIONS = {  # Already compressed formats, deflating them costs CPU time without reducing the size
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "avif", "mp4", "m4v", "mkv", "mov", "avi", "webm", "mp3", "m4a", "aac", "ogg",
+    "opus", "flac", "zip", "7z", "rar", "gz", "tgz", "bz2", "xz", "zst", "jar", "apk", "docx", "xlsx", "pptx", "odt", "ods", "epub"
+}
+UNPACK_SUFFIXES = {".zip": "zip", ".tar": "tar", ".tar.gz": "tar", ".tgz": "tar", ".tar.bz2": "tar", ".tbz2": "tar", ".tar.xz": "tar", ".txz": "tar"}
+PROGRESS_INTERVAL = 0.5  # Seconds between two progress updates of a parallel zip extraction
+
+POOL = None  # Native threads (zlib and file reads release the GIL), a process pool does not work with the gevent hub
+LEVEL = 6
+WINDOW = 8  # Max number of files compressed ahead of the one currently written to the archive
+WORKERS = 4
+
+# Limits of unpacked archives (checked before and during the extraction)
+MAX_BYTES = 2**35  # Total size of all extracted files
+MAX_ENTRIES = 100000  # Number of files and folders
+MAX_RATIO = 100  # Total size of all extracted files divided by the size of the archive
+
+
+def configure(level: int = 6, workers: int | None = None, max_bytes: int = 2**35, max_entries: int = 100000, max_ratio: float = 100) -> None:
+    global POOL, LEVEL, WINDOW, WORKERS, MAX_BYTES, MAX_ENTRIES, MAX_RATIO
+    from gevent.threadpool import ThreadPool  # Imported here, so that the gevent monkey patching happened before
+    WORKERS = workers or os.cpu_count() or 1
+    POOL = ThreadPool(WORKERS)
+    LEVEL = level
+    WINDOW = 2 * WORKERS
+    MAX_BYTES, MAX_ENTRIES, MAX_RATIO = max_bytes, max_entries, max_ratio
+
+
+def compress_entry(path: str, level: int, temp_dir: str) -> tuple[int, int, int, object, int]:
+    # Returns crc, size, compression method, compressed data (None: the file is stored as is) and compressed size
+    crc, size = 0, 0
+    if level == 0 or os.path.splitext(path)[1][1:].lower() in STORED_EXTENSIONS:
+        with open(path, "rb") as source:
+            while chunk := source.read(READ_CHUNK):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        return crc, size, zipfile.ZIP_STORED, None, size
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)  # Raw deflate stream as required by the zip format
+    output = io.BytesIO()
+    with open(path, "rb") as source:
+        while chunk := source.read(READ_CHUNK):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            output.write(compressor.compress(chunk))
+            if isinstance(output, io.BytesIO) and output.tell() > MEMORY_LIMIT:
+                spooled = tempfile.TemporaryFile(dir=temp_dir)
+                spooled.write(output.getbuffer())
+                output = spooled
+    output.write(compressor.flush())
+    compressed_size = output.tell()
+    if compressed_size >= size:  # Incompressible data is stored as well
+        output.close()
+        return crc, size, zipfile.ZIP_STORED, None, size
+    output.seek(0)
+    return crc, size, zipfile.ZIP_DEFLATED, output, compressed_size
+
+
+def dos_time(path: str) -> tuple[int, int]:
+    year, month, day, hour, minute, second = time.localtime(max(os.stat(path).st_mtime, 315532800))[:6]  # Zip dates start in 1980
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def directory_entries(directory: str, prefix: str = "", skip_trash: bool = False) -> list[tuple[str, str]]:
+    # Lists (path, name in the archive) of all folders and files below the directory, names are relative to the directory.
+    # skip_trash: the directory is the root folder of a user, its trash (including unfinished uploads) is not archived.
+    entries = list()
+    for root, dirs, files in os.walk(directory):
+        if skip_trash and root == directory and file_operations.TRASH_DIR in dirs:
+            dirs.remove(file_operations.TRASH_DIR)
+        dirs.sort()
+        name = os.path.join(prefix, os.path.relpath(root, directory)) if root != directory else prefix
+        if name:
+            entries.append((root, name.rstrip("/") + "/"))
+        entries.extend((os.path.join(root, file), os.path.join(name, file)) for file in sorted(files))
+    return entries
+
+
+def zip_stream(entries: list[tuple[str, str]], temp_dir: str):
+    # Yields the archive in chunks, the files are compressed in the thread pool and written in the order of the entries
+    if POOL is None:
+        configure()
+    pending = deque()
+    entries = iter(entries)
+    central_directory = list()
+    offset = 0
+
+    def submit() -> None:
+        for path, name in entries:
+            pending.append((path, name, None if name.endswith("/") else POOL.spawn(compress_entry, path, LEVEL, temp_dir)))
+            return
+
+    for i in range(WINDOW):
+        submit()
+    while pending:
+        path, name, task = pending.popleft()
+        submit()
+        mode = os.stat(path).st_mode
+        if task is None:
+            crc, size, method, data, compressed_size = 0, 0, zipfile.ZIP_STORED, None, 0
+        else:
+            crc, size, method, data, compressed_size = task.get()
+        file_time, file_date = dos_time(path)
+        encoded_name = name.encode("utf-8")
+        zip64 = size >= zipfile.ZIP64_LIMIT or compressed_size >= zipfile.ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 1, 16, size, compressed_size) if zip64 else b""
+        yield struct.pack("<IHHHHHIIIHH", 0x04034b50, 45 if zip64 else 20, 0x800, method, file_time, file_date, crc,
+                          0xffffffff if zip64 else compressed_size, 0xffffffff if zip64 else size, len(encoded_name), len(extra)) + encoded_name + extra
+        central_directory.append((encoded_name, method, file_time, file_date, crc, compressed_size, size, mode, offset))
+        offset += 30 + len(encoded_name) + len(extra)
+        if data is not None:
+            with data:
+                while chunk := data.read(READ_CHUNK):
+                    yield chunk
+        elif task is not None:
+            with open(path, "rb") as source:
+                remaining = size
+                while remaining:
+                    chunk = source.read(min(READ_CHUNK, remaining))
+                    if not chunk:
+                        raise OSError(f"File changed while it was archived: {path}")
+                    remaining -= len(chunk)
+                    yield chunk
+        offset += compressed_size
+
+    start = offset
+    for encoded_name, method, file_time, file_date, crc, compressed_size, size, mode, header_offset in central_directory:
+        zip64 = size >= zipfile.ZIP64_LIMIT or compressed_size >= zipfile.ZIP64_LIMIT or header_offset >= zipfile.ZIP64_LIMIT
+        extra = struct.pack("<HHQQQ", 1, 24, size, compressed_size, header_offset) if zip64 else b""
+        record = struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | 45, 45 if zip64 else 20, 0x800, method, file_time, file_date, crc,
+                             0xffffffff if zip64 else compressed_size, 0xffffffff if zip64 else size, len(encoded_name), len(extra), 0, 0, 0,
+                             (mode & 0xffff) << 16 | (0x10 if encoded_name.endswith(b"/") else 0), 0xffffffff if zip64 else header_offset)
+        offset += len(record) + len(encoded_name) + len(extra)
+        yield record + encoded_name + extra
+    count, size = len(central_directory), offset - start
+    if count >= zipfile.ZIP_FILECOUNT_LIMIT or size >= zipfile.ZIP64_LIMIT or start >= zipfile.ZIP64_LIMIT:
+        yield struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, size, start) + struct.pack("<IIQI", 0x07064b50, 0, offset, 1)
+        count, size, start = min(count, 0xffff), min(size, 0xffffffff), min(start, 0xffffffff)
+    yield struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, size, start, 0)
+
+
+def make_zip(target: str, directory: str, skip_trash: bool = False) -> None:
+    # Replacement for shutil.make_archive(target[:-4], "zip", directory), the temporary data is kept next to the target
+    with open(target, "wb") as archive:
+        for chunk in zip_stream(directory_entries(directory, skip_trash=skip_trash), os.path.dirname(target)):
+            archive.write(chunk)
+
+
+def unpack_suffix(name: str) -> str | None:
+    for suffix in sorted(UNPACK_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            return suffix
+    return None
+
+
+def member_path(target: str, name: str) -> str | None:
+    # Absolute names are placed inside the target, names leaving the target are rejected
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ["", "."]]
+    if not parts or ".." in parts:
+        return None
+    return os.path.join(target, *parts)
+
+
+def check_limits(entries: int, size: int, archive_size: int) -> None:
+    if entries > MAX_ENTRIES:
+        raise ValueError(f"The archive contains more than {MAX_ENTRIES} entries")
+    if size > MAX_BYTES:
+        raise ValueError(f"The extracted files would exceed {MAX_BYTES // 2**30} GB")
+    if size > MAX_RATIO * max(archive_size, 1):
+        raise ValueError(f"The archive expands more than {MAX_RATIO} times")
+
+
+def start_unpack_job(source: str, target: str, owner: str, name: str) -> str:
+    # The target folder is created by the job, name is the target shown to the owner (relative to the user folders)
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, "Target already exists", target)
+    if unpack_suffix(source) is None:
+        raise ValueError("Unsupported archive format")
+    if POOL is None:
+        configure()
+    job_id = secrets.token_hex(8)
+    with file_operations.JOBS_LOCK:
+        file_operations.JOBS[job_id] = {"owner": owner, "status": "running", "files_total": 0, "files_done": 0,
+                                        "bytes_total": 0, "bytes_done": 0, "error": None, "finished": None, "target": name}
+    threading.Thread(target=run_unpack_job, args=(job_id, source, target), daemon=True).start()
+    return job_id
+
+
+def run_unpack_job(job_id: str, source: str, target: str) -> None:
+    job = file_operations.JOBS[job_id]
+    try:
+        os.mkdir(target)
+        if UNPACK_SUFFIXES[unpack_suffix(source)] == "zip":
+            unpack_zip(job, source, target)
+        else:
+            POOL.spawn(unpack_tar, job, source, target).get()  # The decompression runs outside of the gevent hub
+        job["status"] = "done"
+    except Exception as e:  # The job has to finish in any case, broken archives raise various exception types
+        job["status"] = "failed"
+        job["error"] = str(e)
+        shutil.rmtree(target, ignore_errors=True)  # Partially extracted archives are removed completely
+    job["finished"] = time.time()
+
+
+def unpack_zip(job: dict, source: str, target: str) -> None:
+    with zipfile.ZipFile(source) as archive:
+        members = archive.infolist()
+    job["files_total"] = len(members)
+    job["bytes_total"] = sum(member.file_size for member in members)  # zipfile never returns more data than declared
+    check_limits(len(members), job["bytes_total"], os.path.getsize(source))
+    if job["bytes_total"] > shutil.disk_usage(target).free:
+        raise OSError(errno.ENOSPC, "Not enough free disk space", target)
+    files = dict()  # path -> member, a later member with the same name replaces the earlier one (as with tar and unzip)
+    for member in members:
+        path = member_path(target, member.filename)
+        if path is None or (member.external_attr >> 16) & 0o170000 == 0o120000:  # Unsafe names and symbolic links are skipped
+            continue
+        if member.is_dir():
+            os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            files[path] = member
+    files = [(member, path) for path, member in files.items()]
+    # Members are distributed by size, so that every worker extracts about the same amount of data with its own file handle
+    files.sort(key=lambda file: file[0].file_size, reverse=True)
+    progress = [[0, 0] for i in range(WORKERS)]
+    tasks = [POOL.spawn(extract_zip_members, job, source, files[i::WORKERS], progress[i]) for i in range(WORKERS)]
+    while not all(task.ready() for task in tasks):
+        time.sleep(PROGRESS_INTERVAL)
+        job["files_done"] = len(members) - len(files) + sum(done[0] for done in progress)
+        job["bytes_done"] = sum(done[1] for done in progress)
+        if any(task.ready() and not task.successful() for task in tasks):
+            job["status"] = "failed"  # Stops the other workers after their current file
+    for task in tasks:
+        task.get()
+    job["files_done"] = len(members) - len(files) + sum(done[0] for done in progress)
+    job["bytes_done"] = sum(done[1] for done in progress)
+
+
+def extract_zip_members(job: dict, source: str, files: list, progress: list) -> None:
+    # Runs in a native thread, the data is copied through one fixed buffer
+    buffer = bytearray(READ_CHUNK)
+    with zipfile.ZipFile(source) as archive:
+        for member, path in files:
+            if job["status"] != "running":
+                return
+            with archive.open(member) as member_file, open(path, "xb") as target_file:
+                while length := member_file.readinto(buffer):
+                    target_file.write(memoryview(buffer)[:length])
+                    progress[1] += length
+            progress[0] += 1
+
+
+def unpack_tar(job: dict, source: str, target: str) -> None:
+    # Runs in a native thread, the archive is read as a stream (the sizes are only known member by member)
+    archive_size = os.path.getsize(source)
+    buffer = bytearray(READ_CHUNK)
+    with tarfile.open(source, "r|*") as archive:
+        for member in archive:
+            job["files_total"] += 1
+            job["bytes_total"] += member.size if member.isfile() else 0
+            check_limits(job["files_total"], job["bytes_total"], archive_size)
+            path = member_path(target, member.name)
+            if path is None or not (member.isdir() or member.isfile()):  # Links and special files are skipped
+                job["files_done"] += 1
+                continue
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # The target folder is new and links are never created, so "wb" only replaces earlier members with the same name
+                with archive.extractfile(member) as member_file, open(path, "wb") as target_file:
+                    while length := member_file.readinto(buffer):
+                        target_file.write(memoryview(buffer)[:length])
+                        job["bytes_done"] += length
+            job["files_done"] += 1
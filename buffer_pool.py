@@ -0,0 +1,139 @@
+# This file contains the shared buffer pool, that bounds the memory used by all socket transfers and uploads together.
+# Copyright (C) 2023  Nico Pieplow (nitrescov)
+# Contact: nitrescov@protonmail.com
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import threading
+from contextlib import contextmanager
+
+# Constants
+BUFFER_SIZE = 2**21  # Size of every pooled buffer (2 MB), large enough for efficient system calls
+DEFAULT_BUDGET = 2**26  # Total memory of all buffers (64 MB) if configure() is not called
+
+
+class BufferPool:
+    def __init__(self, budget: int, buffer_size: int = BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.count = max(1, budget // buffer_size)
+        self.free = list()  # Buffers are allocated lazily and reused afterwards, they are never freed
+        self.allocated = 0
+        self.in_use = 0
+        self.reserved = 0  # Buffers counted for memory held outside the pool
+        self.peak = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def buffer(self):
+        # Yields a memoryview of a fixed-size buffer, blocks while all buffers of the budget are in use
+        with self.buffers(1) as views:
+            yield views[0]
+
+    @contextmanager
+    def buffers(self, count: int):
+        # Yields a list of memoryviews, all buffers are taken at once (waiting while holding some of them could deadlock)
+        count = min(count, self.count)
+        with self.condition:
+            self.wait_for(lambda: self.available() >= count)
+            taken = list()
+            for i in range(count):
+                if self.free:
+                    taken.append(self.free.pop())
+                else:
+                    taken.append(bytearray(self.buffer_size))
+                    self.allocated += 1
+            self.in_use += count
+            self.peak = max(self.peak, self.in_use)
+        try:
+            yield [memoryview(data) for data in taken]
+        finally:
+            with self.condition:
+                self.free.extend(taken)
+                self.in_use -= count
+                self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, size: int):
+        # Counts memory held outside the pool (e.g. a large data packet) against the budget, free buffers are released for it.
+        # One buffer is never reserved, so that the holder of a reservation can still take a buffer without a deadlock.
+        count = min(-(-size // self.buffer_size), self.count - 1)
+        with self.condition:
+            self.wait_for(lambda: self.available() >= count and self.reserved + count < self.count)
+            for i in range(count):
+                if self.free:
+                    self.free.pop()
+                else:
+                    self.allocated += 1
+            self.reserved += count
+            self.in_use += count
+            self.peak = max(self.peak, self.in_use)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.allocated -= count
+                self.reserved -= count
+                self.in_use -= count
+                self.condition.notify_all()
+
+    def available(self) -> int:
+        return len(self.free) + self.count - self.allocated
+
+    def wait_for(self, predicate) -> None:
+        # Blocks until the predicate is true (the condition must be held) and records the waiting time
+        if predicate():
+            return
+        start = time.monotonic()
+        while not predicate():
+            self.condition.wait()
+        waited = time.monotonic() - start
+        self.waits += 1
+        self.wait_time += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def stats(self) -> dict:
+        return {"buffer_size": self.buffer_size, "buffers": self.count, "allocated": self.allocated, "in_use": self.in_use, "reserved": self.reserved,
+                "peak": self.peak, "waits": self.waits, "wait_time": round(self.wait_time, 3), "max_wait": round(self.max_wait, 3)}
+
+
+POOL = None  # Created on first use or by configure(), so that the condition is created after the gevent monkey patching
+
+
+def configure(budget: int = DEFAULT_BUDGET) -> None:
+    global POOL
+    POOL = BufferPool(budget)
+
+
+def get_pool() -> BufferPool:
+    if POOL is None:
+        configure()
+    return POOL
+
+
+def buffer():
+    return get_pool().buffer()
+
+
+def buffers(count: int):
+    return get_pool().buffers(count)
+
+
+def reserve(size: int):
+    return get_pool().reserve(size)
+
+
+def stats() -> dict:
+    return get_pool().stats()
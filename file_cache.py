@@ -0,0 +1,102 @@
+# This file contains the optional in-memory cache of small, frequently downloaded files.
+# Copyright (C) 2023  Nico Pieplow (nitrescov)
+# Contact: nitrescov@protonmail.com
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+from gevent import monkey
+from collections import OrderedDict
+
+
+class FileCache:
+    def __init__(self, budget: int, max_file_size: int):
+        self.budget = budget  # Max number of bytes of all cached files together
+        self.max_file_size = max_file_size
+        self.entries = OrderedDict()  # (inode, mtime, size) -> (path, data, etag, mtime), least recently used first
+        self.paths = dict()  # path -> key of its entry, used for the invalidation
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # A real lock: the entries are also invalidated from the native threads of the batch operations (a gevent lock is not thread-safe)
+        self.lock = monkey.get_original("threading", "Lock")()
+
+    def get(self, path: str) -> tuple[bytes, str, float] | None:
+        # Returns data, ETag and modification time of the file or None if it is too large to be cached
+        stats = os.stat(path)
+        key = (stats.st_ino, stats.st_mtime_ns, stats.st_size)  # A modified file gets a new key, stale entries are never returned
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][1:]
+            self.misses += 1
+        if stats.st_size > self.max_file_size or stats.st_size > self.budget:
+            return None
+        with open(path, "rb") as f:
+            data = f.read(stats.st_size + 1)
+        if len(data) != stats.st_size or os.stat(path).st_mtime_ns != stats.st_mtime_ns:
+            return None  # Modified while reading
+        entry = (path, data, '"' + hashlib.sha1(data).hexdigest() + '"', stats.st_mtime)
+        with self.lock:
+            self.remove_path(path)
+            self.entries[key] = entry
+            self.paths[path] = key
+            self.used += len(data)
+            while self.used > self.budget:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+        return entry[1:]
+
+    def remove(self, key: tuple) -> None:
+        path, data, etag, mtime = self.entries.pop(key)
+        self.used -= len(data)
+        if self.paths.get(path) == key:
+            del self.paths[path]
+
+    def invalidate(self, path: str) -> None:
+        with self.lock:
+            self.remove_path(path)
+
+    def remove_path(self, path: str) -> None:
+        # Removes the file or all files inside the folder (the lock must be held)
+        path = path.rstrip("/")
+        for cached_path in [cached_path for cached_path in self.paths if cached_path == path or cached_path.startswith(path + "/")]:
+            self.remove(self.paths[cached_path])
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"files": len(self.entries), "used": self.used, "budget": self.budget, "max_file_size": self.max_file_size,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+CACHE = None  # Disabled until configure() is called with a budget
+
+
+def configure(budget: int, max_file_size: int) -> None:
+    global CACHE
+    CACHE = FileCache(budget, max_file_size) if budget > 0 else None
+
+
+def get(path: str) -> tuple[bytes, str, float] | None:
+    return CACHE.get(os.path.normpath(path)) if CACHE else None
+
+
+def invalidate(path: str) -> None:
+    if CACHE:
+        CACHE.invalidate(os.path.normpath(path))
+
+
+def stats() -> dict | None:
+    return CACHE.stats() if CACHE else None
@@ -0,0 +1,231 @@
+# This file contains the server-side file operations (move, rename, copy and trash) shared by the webserver and the socket interface.
+# Copyright (C) 2023  Nico Pieplow (nitrescov)
+# Contact: nitrescov@protonmail.com
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import errno
+import shutil
+import secrets
+import threading
+import access_log
+import file_cache
+
+try:  # fcntl only exists on unix systems, reflinks are skipped on other platforms
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Constants
+COPY_CHUNK = 2**23  # Max number of bytes copied per system call (8 MB), keeps single calls short for the gevent hub
+FICLONE = 0x40049409  # Linux ioctl request to share all extents of a file (reflink on btrfs, xfs, ...)
+JOB_MAX_AGE = 3600  # Seconds a finished job stays queryable
+TRASH_DIR = ".trash"  # Name of the trash folder inside each user directory (same file system, so deleting is a rename)
+PURGE_MIN_COST = 2**16  # Every purged file is accounted with at least 64 KB against the purge rate (metadata updates)
+
+# Registry of the running and recently finished copy jobs (job id -> job state)
+JOBS = dict()
+JOBS_LOCK = threading.Lock()
+
+
+def move_entry(source: str, target: str) -> None:
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, "Target already exists", target)
+    file_cache.invalidate(source)
+    try:
+        os.rename(source, target)  # Atomic and instant within the same file system
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source, target, copy_function=copy_file)
+
+
+def copy_file(source: str, target: str) -> str:
+    with open(source, "rb") as src, open(target, "xb") as dst:
+        if not clone_file(src.fileno(), dst.fileno()):
+            copy_range(src, dst)
+    shutil.copystat(source, target)
+    return target
+
+
+def clone_file(src_fd: int, dst_fd: int) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)  # The copy shares the data blocks of the source (copy-on-write)
+        return True
+    except OSError:
+        return False  # Not supported by the file system or source and target on different file systems
+
+
+def copy_range(src, dst, progress=None) -> None:
+    if hasattr(os, "copy_file_range"):
+        try:
+            while True:  # The data is copied inside the kernel (or even the storage device) without passing user space
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), COPY_CHUNK)
+                if copied == 0:
+                    return
+                if progress:
+                    progress(copied)
+                time.sleep(0)  # Allow other greenlets to run between the chunks
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+    while True:  # Fallback: chunked copy through user space (continues at the current offset of both files)
+        data = src.read(COPY_CHUNK)
+        if not data:
+            return
+        dst.write(data)
+        if progress:
+            progress(len(data))
+        time.sleep(0)
+
+
+def start_copy_job(source: str, target: str, owner: str) -> str:
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, "Target already exists", target)
+    job_id = secrets.token_hex(8)
+    with JOBS_LOCK:
+        JOBS[job_id] = {"owner": owner, "status": "running", "files_total": 0, "files_done": 0,
+                        "bytes_total": 0, "bytes_done": 0, "error": None, "finished": None}
+    threading.Thread(target=run_copy_job, args=(job_id, source, target), daemon=True).start()
+    return job_id
+
+
+def run_copy_job(job_id: str, source: str, target: str) -> None:
+    job = JOBS[job_id]
+    try:
+        for root, dirs, files in os.walk(source):
+            job["files_total"] += len(files)
+            job["bytes_total"] += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+
+        def copy_tracked(src_name: str, dst_name: str) -> str:
+            with open(src_name, "rb") as src, open(dst_name, "xb") as dst:
+                if clone_file(src.fileno(), dst.fileno()):
+                    job["bytes_done"] += os.path.getsize(src_name)
+                else:
+                    copy_range(src, dst, lambda copied: job.__setitem__("bytes_done", job["bytes_done"] + copied))
+            shutil.copystat(src_name, dst_name)
+            job["files_done"] += 1
+            return dst_name
+
+        shutil.copytree(source, target, copy_function=copy_tracked)
+        job["status"] = "done"
+    except (OSError, shutil.Error) as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+    job["finished"] = time.time()
+
+
+def get_job(job_id: str, owner: str) -> dict | None:
+    job = JOBS.get(job_id)
+    if job is None or job["owner"] != owner:
+        return None
+    return dict(job, id=job_id)
+
+
+def prune_jobs() -> None:
+    with JOBS_LOCK:
+        for job_id in [job_id for job_id, job in JOBS.items() if job["finished"] and time.time() - job["finished"] > JOB_MAX_AGE]:
+            del JOBS[job_id]
+
+
+def move_to_trash(source: str, trash: str, origin: str) -> str:
+    os.makedirs(trash, exist_ok=True)
+    file_cache.invalidate(source)
+    entry_id = f"{time.time_ns()}-{secrets.token_hex(4)}"
+    entry_dir = os.path.join(trash, entry_id)
+    os.mkdir(entry_dir)
+    try:  # The metadata is written first, so that a moved entry always has it
+        with open(entry_dir + ".json", "w", encoding="utf-8") as info_file:
+            json.dump({"origin": origin, "deleted": time.time()}, info_file)
+        os.rename(source, os.path.join(entry_dir, os.path.basename(source)))  # O(1), independent of the folder size
+    except OSError:
+        if os.path.exists(entry_dir + ".json"):  # Nothing was moved, no empty entry is left behind
+            os.remove(entry_dir + ".json")
+        os.rmdir(entry_dir)
+        raise
+    return entry_id
+
+
+def read_info(trash: str, entry_id: str) -> dict | None:
+    # Returns None if the metadata of the entry is missing or damaged (e.g. truncated by a power loss)
+    try:
+        with open(os.path.join(trash, entry_id + ".json"), "r", encoding="utf-8") as info_file:
+            info = json.load(info_file)
+        if isinstance(info.get("deleted"), (int, float)) and isinstance(info.get("origin"), str):
+            return dict(info, id=entry_id)
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def list_trash(trash: str) -> list[dict]:
+    entries = list()
+    if os.path.isdir(trash):
+        for info_name in os.listdir(trash):
+            if info_name.endswith(".json"):
+                entry = read_info(trash, info_name[:-5])
+                if entry:
+                    entries.append(entry)
+    return sorted(entries, key=lambda entry: entry["deleted"], reverse=True)
+
+
+def restore_from_trash(trash: str, entry_id: str, target: str) -> None:
+    entry_dir = os.path.join(trash, entry_id)
+    if not os.path.isfile(entry_dir + ".json") or os.path.basename(entry_id) != entry_id:
+        raise FileNotFoundError(errno.ENOENT, "No such trash entry", entry_id)
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, "Target already exists", target)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.rename(os.path.join(entry_dir, os.path.basename(target)), target)
+    os.rmdir(entry_dir)
+    os.remove(entry_dir + ".json")
+
+
+def purge_trash(trash: str, retention: float, rate: float) -> None:
+    # Removes expired entries file by file and sleeps in between, so that at most 'rate' bytes per second are freed.
+    # Entries without readable metadata are removed as well, their age is taken from the file system.
+    if not os.path.isdir(trash):
+        return
+    for entry_id in sorted({name.removesuffix(".json") for name in os.listdir(trash) if not name.startswith(".")}):
+        entry_dir = os.path.join(trash, entry_id)
+        try:
+            entry = read_info(trash, entry_id)
+            deleted = entry["deleted"] if entry else os.lstat(entry_dir if os.path.lexists(entry_dir) else entry_dir + ".json").st_mtime
+            if time.time() - deleted >= retention:
+                purge_entry(entry_dir, rate)
+        except OSError as e:  # e.g. restored or removed meanwhile, the other entries are purged anyway
+            access_log.log("warning", source="trash", event="purge failed", entry=entry_id, error=str(e))
+
+
+def purge_entry(entry_dir: str, rate: float) -> None:
+    for root, dirs, files in os.walk(entry_dir, topdown=False):
+        for file in files:
+            try:
+                cost = max(os.lstat(os.path.join(root, file)).st_size, PURGE_MIN_COST)
+                os.remove(os.path.join(root, file))
+            except FileNotFoundError:
+                continue
+            time.sleep(cost / rate)
+        for folder in dirs:
+            if os.path.islink(os.path.join(root, folder)):
+                os.remove(os.path.join(root, folder))
+            else:
+                os.rmdir(os.path.join(root, folder))
+    if os.path.isdir(entry_dir):
+        os.rmdir(entry_dir)
+    if os.path.exists(entry_dir + ".json"):
+        os.remove(entry_dir + ".json")
@@ -13,6 +13,47 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.
 # If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
+
+# Shared stylesheet of all generated pages (served once at /style.css and cached by the browser)
+STYLESHEET = (
+    'body{background-color:#59595F;font-family:sans-serif}'
+    'a{text-decoration:none}'
+    'input{font-family:sans-serif}'
+    '.h{font-size:24px;text-align:center;font-weight:bold;color:black;background-color:#88DD3A;'
+    'border-radius:10px;margin:16px;margin-bottom:32px;padding:8px;box-shadow:2px 2px 4px #262626}'
+    '.e{margin:auto;font-size:14px;text-align:center;color:black;background-color:#FF4C4C;'
+    'border-radius:4px;margin-top:32px;padding:8px;width:400px}'
+    '.rf{margin:auto;width:250px;height:100px}'
+    '.rb{position:relative;left:50px;font-size:14px;text-align:center;width:150px;color:black;background-color:#88DD3A;'
+    'border-radius:4px;border-style:hidden;margin-top:32px;padding:8px;box-shadow:2px 2px 4px #262626;cursor:pointer}'
+    '.lf{margin:auto;width:450px;height:250px;border:2px solid #3D3D42;box-shadow:0px 0px 5px #3D3D42}'
+    '.li{position:relative;left:75px;font-size:14px;text-align:left;width:300px;color:black;background-color:white;'
+    'border-radius:4px;border-style:hidden;margin-top:18px;padding:8px}'
+    '.lh{position:relative;left:75px;font-size:12px;text-align:left;width:300px;color:black;margin-top:3px;padding:1px}'
+    '.ls{left:150px;margin-top:24px}'
+    '.r,.m{text-align:center;font-size:16px}'
+    '.n{width:500px;display:inline-block;text-align:left;color:white;border-bottom:1px solid #787878;padding:8px;vertical-align:middle}'
+    '.n img,.b img{vertical-align:middle}'
+    '.n span{vertical-align:middle;margin-left:16px}'
+    '.d{width:20px;padding:8px;margin-left:8px;display:inline-block;vertical-align:middle}'
+    '.b{width:225px;margin:6px;color:black;padding:8px;border-bottom:1px solid black;border-right:1px solid black;'
+    'display:inline-block;background-color:#787878;text-align:left;vertical-align:top}'
+    '.b span{vertical-align:middle;margin-left:12px}'
+    '.f{width:242px;margin:6px;display:inline-block;vertical-align:top}'
+    '.fs{width:242px;background-color:#787878;background-repeat:no-repeat;background-position:8px;font-size:16px;padding:8px;'
+    'padding-left:36px;color:black;border:none;border-bottom:1px solid black;border-right:1px solid black;cursor:pointer;text-align:left}'
+    '.fi{border-radius:4px;border-style:hidden;padding:7px;width:242px;background-color:#D8D8D8;font-size:14px;margin-top:8px}'
+    '.ff{padding:4px}'
+    '.fn{padding-left:8px}'
+    '.x{vertical-align:middle;margin-right:8px}'
+    '.c{margin:auto;font-size:16px;text-align:center;color:white}'
+    '.v{margin:auto;font-size:12px;text-align:center;color:#787878;border-top:1px solid #787878;width:250px;padding:10px}'
+)
+STYLESHEET_VERSION = hashlib.sha1(STYLESHEET.encode('utf-8')).hexdigest()[:12]  # changes the stylesheet URL on every update
+STYLESHEET_LINK = f'<link rel="stylesheet" href="/style.css?v={STYLESHEET_VERSION}">'
+
+
 class HtmlPages:
     def __init__(self, owner, language):
 
@@ -22,85 +63,64 @@ class HtmlPages:
             <head>
                 <meta charset="utf-8">
                 <title>RaspiNAS Anmeldung</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <h1 style="font-family:sans-serif; font-size:24px; text-align:center; font-weight:bold; color:black; background-color:#88DD3A; 
-                border-radius:10px; margin:16px; margin-bottom:32px; padding:8px; box-shadow:2px 2px 4px #262626">
-                    - {owner} RaspiNAS -
-                </h1>
-                <form action="/home" method="post" style="margin:auto; width:450px; height:250px; background-color:#59595F; 
-                border-style:solid; border-color:#3D3D42; border-width:2px; box-shadow:0px 0px 5px #3D3D42">
-                    <input name="name" type="text" style="position:relative; left:75px; font-family:sans-serif; font-size:14px; text-align:left; 
-                    width:300px; color:black; background-color:white; border-radius:4px; border-style:hidden; margin-top:18px; padding:8px" placeholder="vorname" />
-                    <p style="position:relative; left:75px; font-family:sans-serif; font-size:12px; text-align:left; 
-                    width:300px; color:black; background-color:#59595F; margin-top:3px; padding:1px">
-                        Vorname (Kleinbuchstaben)
-                    </p>
-                    <input name="pin" type="password" style="position:relative; left:75px; font-family:sans-serif; font-size:14px; text-align:left; 
-                    width:300px; color:black; background-color:white; border-radius:4px; border-style:hidden; margin-top:18px; padding:8px" placeholder="nummer" />
-                    <p style="position:relative; left:75px; font-family:sans-serif; font-size:12px; text-align:left; 
-                    width:300px; color:black; background-color:#59595F; margin-top:3px; padding:1px">
-                        Kennnummer
-                    </p>
-                    <input value="Anmelden" type="submit" style="position:relative; left:150px; font-family:sans-serif; font-size:14px; text-align:center; 
-                    width:150px; color:black; background-color:#88DD3A; border-radius:4px; border-style:hidden; margin-top:24px; padding:8px; box-shadow:2px 2px 4px #262626" />
+            <body>
+                <h1 class="h">- {owner} RaspiNAS -</h1>
+                <form action="/home" method="post" class="lf">
+                    <input name="name" type="text" class="li" placeholder="vorname" />
+                    <p class="lh">Vorname (Kleinbuchstaben)</p>
+                    <input name="pin" type="password" class="li" placeholder="nummer" />
+                    <p class="lh">Kennnummer</p>
+                    <input value="Anmelden" type="submit" class="rb ls" />
                 </form>
             </body>
             ''')
 
-            self.LoginFailed = ('''
+            self.LoginFailed = (f'''
             <head>
                 <meta charset="utf-8">
                 <title>Anmeldung fehlgeschlagen</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                    Anmeldung fehlgeschlagen: Daten sind nicht korrekt.
-                </p>
-                <form action="/home" style="margin:auto; width:250px; height:100px; background-color:#59595F">
-                    <input value="Wiederholen?" type="submit" style="position:relative; left:50px; font-family:sans-serif; font-size:14px; text-align:center; 
-                    width:150px; color:black; background-color:#88DD3A; border-radius:4px; border-style:hidden; margin-top:32px; padding:8px; box-shadow:2px 2px 4px #262626" />
+            <body>
+                <p class="e">Anmeldung fehlgeschlagen: Daten sind nicht korrekt.</p>
+                <form action="/home" class="rf">
+                    <input value="Wiederholen?" type="submit" class="rb" />
                 </form>
             </body>
             ''')
 
-            self.NoDirectory = ('''
+            self.NoDirectory = (f'''
             <head>
                 <meta charset="utf-8">
                 <title>kein Verzeichnis</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                    Fehler: Das angegebene Verzeichnis existiert nicht.
-                </p>
+            <body>
+                <p class="e">Fehler: Das angegebene Verzeichnis existiert nicht.</p>
             </body>
             ''')
 
-            self.NoFile = ('''
+            self.NoFile = (f'''
             <head>
                 <meta charset="utf-8">
                 <title>keine Datei</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                    Fehler: Die angegebene Datei existiert nicht.
-                </p>
+            <body>
+                <p class="e">Fehler: Die angegebene Datei existiert nicht.</p>
             </body>
             ''')
 
-            self.AccessDenied = ('''
+            self.AccessDenied = (f'''
             <head>
                 <meta charset="utf-8">
                 <title>kein Zugriff</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                    Zugriff verweigert: Du bist nicht angemeldet.
-                </p>
+            <body>
+                <p class="e">Zugriff verweigert: Du bist nicht angemeldet.</p>
             </body>
             ''')
 
@@ -109,84 +129,63 @@ class HtmlPages:
             <head>
                 <meta charset="utf-8">
                 <title>RaspiNAS Login</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <h1 style="font-family:sans-serif; font-size:24px; text-align:center; font-weight:bold; color:black; background-color:#88DD3A; 
-                border-radius:10px; margin:16px; margin-bottom:32px; padding:8px; box-shadow:2px 2px 4px #262626">
-                    - {owner} RaspiNAS -
-                </h1>
-                <form action="/home" method="post" style="margin:auto; width:450px; height:250px; background-color:#59595F; 
-                border-style:solid; border-color:#3D3D42; border-width:2px; box-shadow:0px 0px 5px #3D3D42">
-                    <input name="name" type="text" style="position:relative; left:75px; font-family:sans-serif; font-size:14px; text-align:left; 
-                    width:300px; color:black; background-color:white; border-radius:4px; border-style:hidden; margin-top:18px; padding:8px" placeholder="name" />
-                    <p style="position:relative; left:75px; font-family:sans-serif; font-size:12px; text-align:left; 
-                    width:300px; color:black; background-color:#59595F; margin-top:3px; padding:1px">
-                        Username (lower case letters)
-                    </p>
-                    <input name="pin" type="password" style="position:relative; left:75px; font-family:sans-serif; font-size:14px; text-align:left; 
-                    width:300px; color:black; background-color:white; border-radius:4px; border-style:hidden; margin-top:18px; padding:8px" placeholder="pin" />
-                    <p style="position:relative; left:75px; font-family:sans-serif; font-size:12px; text-align:left; 
-                    width:300px; color:black; background-color:#59595F; margin-top:3px; padding:1px">
-                        Identification number (pin)
-                    </p>
-                    <input value="Login" type="submit" style="position:relative; left:150px; font-family:sans-serif; font-size:14px; text-align:center; 
-                    width:150px; color:black; background-color:#88DD3A; border-radius:4px; border-style:hidden; margin-top:24px; padding:8px; box-shadow:2px 2px 4px #262626" />
+            <body>
+                <h1 class="h">- {owner} RaspiNAS -</h1>
+                <form action="/home" method="post" class="lf">
+                    <input name="name" type="text" class="li" placeholder="name" />
+                    <p class="lh">Username (lower case letters)</p>
+                    <input name="pin" type="password" class="li" placeholder="pin" />
+                    <p class="lh">Identification number (pin)</p>
+                    <input value="Login" type="submit" class="rb ls" />
                 </form>
             </body>
             ''')
 
-            self.LoginFailed = ('''
+            self.LoginFailed = (f'''
             <head>
                 <meta charset="utf-8">
                 <title>Login failed</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                    Login failed: Your credentials are not correct.
-                </p>
-                <form action="/home" style="margin:auto; width:250px; height:100px; background-color:#59595F">
-                    <input value="Retry?" type="submit" style="position:relative; left:50px; font-family:sans-serif; font-size:14px; text-align:center; 
-                    width:150px; color:black; background-color:#88DD3A; border-radius:4px; border-style:hidden; margin-top:32px; padding:8px; box-shadow:2px 2px 4px #262626" />
+            <body>
+                <p class="e">Login failed: Your credentials are not correct.</p>
+                <form action="/home" class="rf">
+                    <input value="Retry?" type="submit" class="rb" />
                 </form>
             </body>
             ''')
 
-            self.NoDirectory = ('''
+            self.NoDirectory = (f'''
             <head>
                 <meta charset="utf-8">
                 <title>Directory not found</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                    Error: The given directory does not exist.
-                </p>
+            <body>
+                <p class="e">Error: The given directory does not exist.</p>
             </body>
             ''')
 
-            self.NoFile = ('''
+            self.NoFile = (f'''
             <head>
                 <meta charset="utf-8">
                 <title>File not found</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                    Error: The given file does not exist.
-                </p>
+            <body>
+                <p class="e">Error: The given file does not exist.</p>
             </body>
             ''')
 
-            self.AccessDenied = ('''
+            self.AccessDenied = (f'''
             <head>
                 <meta charset="utf-8">
                 <title>Access denied</title>
+                {STYLESHEET_LINK}
             </head>
-            <body style="background-color:#59595F">
-                <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                    Access denied: You are not logged in.
-                </p>
+            <body>
+                <p class="e">Access denied: You are not logged in.</p>
             </body>
             ''')
@@ -0,0 +1,189 @@
+# This file contains the background integrity scrub, that detects silently corrupted files using stored checksums.
+# Copyright (C) 2023  Nico Pieplow (nitrescov)
+# Contact: nitrescov@protonmail.com
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import sqlite3
+import hashlib
+import access_log
+import file_operations
+
+# Constants
+SCRUB_CHUNK = 2**20  # Bytes read per step (1 MB), the scrub sleeps after every chunk to stay within its rate
+SCRUB_MIN_COST = 2**16  # Every checked file is accounted with at least 64 KB against the scrub rate (opening and metadata reads)
+IDLE_SECONDS = 10  # The scrub pauses until there was no user activity for this number of seconds
+PASS_PAUSE = 86400  # Seconds between two complete passes over all files
+COMMIT_FILES = 100  # The results are committed after this number of files or COMMIT_INTERVAL seconds (one journal write per batch)
+COMMIT_INTERVAL = 30
+CHECKSUM = "sha384"  # Algorithm of the checksums calculated by the scrub
+MAX_WRITTEN = 10000  # Max number of checksums of new uploads waiting to be stored
+
+POOL = None  # Native threads, so that the file reads and the database don't block the gevent hub (scrub and status queries)
+last_activity = 0.0
+recording = False  # Checksums calculated while writing are only collected while the scrub is running
+written = dict()  # Full path -> (size, mtime_ns, checksum, algorithm) of new uploads, stored with the next commit of the scrub
+ALGORITHMS = {CHECKSUM: hashlib.sha384}  # Checksums the scrub can verify, the socket interface adds its negotiable algorithms
+
+
+def note_activity() -> None:
+    global last_activity
+    last_activity = time.monotonic()
+
+
+def record(full_path: str, checksum: bytes, algorithm: str = CHECKSUM) -> None:
+    # Stores the checksum calculated while the file was written, so that corruption before its first scrub is detected as well
+    if not recording or len(written) >= MAX_WRITTEN or algorithm not in ALGORITHMS:
+        return
+    try:
+        stats = os.stat(full_path)
+    except OSError:
+        return
+    written[full_path] = (stats.st_size, stats.st_mtime_ns, checksum, algorithm)
+
+
+class Scrubber:
+    def __init__(self, database: str, basepath: str, rate: float):
+        self.database = database
+        self.root = os.path.join(basepath, "users")
+        self.rate = rate  # Max bytes per second read by the scrub
+        self.sleep = time.sleep
+
+    def start(self) -> None:
+        global POOL
+        from gevent import monkey
+        from gevent.threadpool import ThreadPool  # Imported here, so that the gevent monkey patching happened before
+        POOL = ThreadPool(2)
+        self.sleep = monkey.get_original("time", "sleep")  # The scrub runs in a native thread, it must not wait for a gevent hub
+        POOL.spawn(self.run)
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.database)
+        connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, checksum BLOB, checked REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS mismatches (path TEXT, expected BLOB, actual BLOB, detected REAL)")
+        if not connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'mismatches_path'").fetchone():
+            # Databases of older versions list a corrupted file once per pass
+            connection.execute("DELETE FROM mismatches WHERE rowid NOT IN (SELECT MIN(rowid) FROM mismatches GROUP BY path)")
+            connection.execute("CREATE UNIQUE INDEX mismatches_path ON mismatches (path)")
+            connection.commit()
+        connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        if "algorithm" not in [column[1] for column in connection.execute("PRAGMA table_info(files)")]:
+            connection.execute("ALTER TABLE files ADD COLUMN algorithm TEXT")  # NULL: checksum of older versions (CHECKSUM)
+            connection.commit()
+        return connection
+
+    def run(self) -> None:
+        global recording
+        recording = True
+        db = self.connect()
+        while True:
+            state = dict(db.execute("SELECT key, value FROM state").fetchall())
+            if not state.get("pass_started"):  # Otherwise the interrupted pass is resumed at the stored cursor
+                state["pass_started"] = str(time.time())
+                state["cursor"] = ""
+                db.execute("REPLACE INTO state VALUES ('pass_started', ?)", (state["pass_started"],))
+                db.commit()
+            cursor = tuple(state["cursor"].split("/")) if state["cursor"] else ()
+            checked, last_commit = 0, time.monotonic()
+            for path in self.walk(self.root, (), cursor):
+                self.check_file(db, path)
+                checked += 1
+                if checked >= COMMIT_FILES or time.monotonic() - last_commit >= COMMIT_INTERVAL:
+                    db.execute("REPLACE INTO state VALUES ('cursor', ?)", (path,))  # Committed together with the results up to the cursor
+                    self.store_written(db)
+                    db.commit()
+                    checked, last_commit = 0, time.monotonic()
+            self.store_written(db)
+            # Files that were not seen during the whole pass don't exist anymore
+            db.execute("DELETE FROM files WHERE checked < ?", (float(state["pass_started"]),))
+            db.execute("REPLACE INTO state VALUES ('pass_completed', ?)", (str(time.time()),))
+            db.execute("DELETE FROM state WHERE key IN ('pass_started', 'cursor')")
+            db.commit()
+            pass_end = time.monotonic() + PASS_PAUSE
+            while time.monotonic() < pass_end:
+                self.sleep(COMMIT_INTERVAL)
+                if written:
+                    self.store_written(db)
+                    db.commit()
+
+    def store_written(self, db: sqlite3.Connection) -> None:
+        while written:
+            full_path, (size, mtime_ns, checksum, algorithm) = written.popitem()
+            path = os.path.relpath(full_path, self.root)
+            if not path.startswith("../"):
+                db.execute("REPLACE INTO files (path, size, mtime_ns, checksum, checked, algorithm) VALUES (?, ?, ?, ?, ?, ?)",
+                           (path, size, mtime_ns, checksum, time.time(), algorithm))
+
+    def walk(self, directory: str, prefix: tuple, cursor: tuple):
+        # Yields all files in the lexicographic order of their path components, so that a pass can resume after the cursor
+        for name in sorted(os.listdir(directory)):
+            parts = prefix + (name,)
+            path = os.path.join(directory, name)
+            if len(parts) == 2 and name == file_operations.TRASH_DIR:
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                if parts >= cursor[:len(parts)]:  # Skip folders that were completely checked before the restart
+                    yield from self.walk(path, parts, cursor)
+            elif os.path.isfile(path) and parts > cursor:
+                yield "/".join(parts)
+
+    def check_file(self, db: sqlite3.Connection, path: str) -> None:
+        full_path = os.path.join(self.root, path)
+        row = db.execute("SELECT size, mtime_ns, checksum, algorithm FROM files WHERE path = ?", (path,)).fetchone()
+        try:
+            stats = os.stat(full_path)
+            unchanged = row and row[0] == stats.st_size and row[1] == stats.st_mtime_ns and (row[3] or CHECKSUM) in ALGORITHMS
+            algorithm = (row[3] or CHECKSUM) if unchanged else CHECKSUM  # Recorded checksums are verified with their own algorithm
+            checksum = self.hash_file(full_path, algorithm)
+            if os.stat(full_path).st_mtime_ns != stats.st_mtime_ns:
+                return  # Modified while reading, the next pass will record it
+        except OSError:
+            return
+        if unchanged and row[2] != checksum:
+            # Same size and modification time, but different content: the data changed without being written
+            db.execute("INSERT OR IGNORE INTO mismatches VALUES (?, ?, ?, ?)", (path, row[2], checksum, time.time()))  # Listed once
+            access_log.log("warning", source="scrub", event="checksum mismatch", path=path)
+            checksum = row[2]  # Keep the original checksum, so that the file is reported again until it is replaced
+        elif row and not unchanged:
+            db.execute("DELETE FROM mismatches WHERE path = ?", (path,))  # The file was replaced
+        db.execute("REPLACE INTO files (path, size, mtime_ns, checksum, checked, algorithm) VALUES (?, ?, ?, ?, ?, ?)",
+                   (path, stats.st_size, stats.st_mtime_ns, checksum, time.time(), algorithm))
+
+    def hash_file(self, full_path: str, algorithm: str = CHECKSUM) -> bytes:
+        hash_object = ALGORITHMS[algorithm]()
+        size = 0
+        with open(full_path, "rb") as f:
+            while True:
+                while time.monotonic() - last_activity < IDLE_SECONDS:
+                    self.sleep(1)
+                data = f.read(SCRUB_CHUNK)
+                if not data:
+                    break
+                hash_object.update(data)
+                size += len(data)
+                self.sleep(len(data) / self.rate)
+        if size < SCRUB_MIN_COST:  # Small files are throttled as well
+            self.sleep((SCRUB_MIN_COST - size) / self.rate)
+        return hash_object.digest()
+
+    def status(self) -> dict:
+        return POOL.spawn(self.read_status).get() if POOL else self.read_status()
+
+    def read_status(self) -> dict:
+        db = self.connect()
+        status = dict(db.execute("SELECT key, value FROM state").fetchall())
+        status["files"] = db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        status["mismatches"] = db.execute("SELECT path, detected FROM mismatches ORDER BY detected DESC").fetchall()
+        db.close()
+        return status
@@ -15,19 +15,35 @@
 
 # Currently recommended Python version: 3.10.9
 
+# import gevent (patched before all other imports, ssl and threading must not be imported unpatched)
+from gevent import monkey
+monkey.patch_all()
+
 import os
+import ssl
+import gzip
 import json
+import time
 import random
 import bottle
-import shutil
 import hashlib
+import mimetypes
 import threading
+import scrub
+import archive
+import access_log
+import buffer_pool
+import file_cache
+import file_operations
 import socket_interface
-from html_pages import HtmlPages
+import upload_writer
+from gevent.threadpool import ThreadPool
+from html_pages import HtmlPages, STYLESHEET, STYLESHEET_VERSION, STYLESHEET_LINK
 
-# import gevent
-from gevent import monkey
-monkey.patch_all()
+try:  # brotli is optional, gzip from the standard library is used as fallback
+    import brotli
+except ImportError:
+    brotli = None
 
 # import subprocess  # alternative to shutil
 
@@ -47,11 +63,31 @@ except FileNotFoundError:  # Set fallback values
         'storage_path': '',  # path where the uploaded files are stored (e.g. '/home/user/files/')
         'cert_file': 'raspinas.crt',  # name (or path) of the SSL certificate file
         'key_file': 'raspinas.key',  # name (or path) of the SSL key file
+        'socket_tls': True,  # encrypt the socket interface with the same TLS context as the webserver
+        'batch_workers': 4,  # max number of files or folders processed in parallel by a batch operation
+        'trash_retention_days': 7,  # days until deleted files and folders are removed from the trash
+        'trash_purge_rate': 16,  # max MB per second freed by the background purge of the trash
+        'scrub_rate': 4,  # max MB per second read by the background integrity scrub (0 disables the scrub)
+        'scrub_database': 'scrub.db',  # name (or path) of the database storing the checksums of the scrub
+        'admin_users': [],  # names of the users allowed to view the admin pages (e.g. scrub results)
+        'socket_checksums': ['sha384', 'blake2b'],  # checksum algorithms clients may choose (add 'crc32', 'xxh3' or 'crc32c' only in trusted networks)
+        'socket_token_hours': 24,  # lifetime of the resume tokens issued at the socket login
+        'zip_level': 6,  # compression level of zip downloads (0 - 9), already compressed media files are always stored
+        'unpack_max_gb': 32,  # max total size of the files extracted from one archive
+        'unpack_max_entries': 100000,  # max number of files and folders in an unpacked archive
+        'unpack_max_ratio': 100,  # max ratio between the extracted size and the archive size (protects against zip bombs)
+        'file_cache_mb': 32,  # memory for caching small, frequently downloaded files (0 disables the cache)
+        'file_cache_max_kb': 1024,  # larger files are always read from the storage
+        'upload_durability': 'file',  # 'file': every upload is flushed to the disk on its own, 'group': finished uploads are flushed together
+        'socket_buffer_mb': 64,  # total memory of the buffers shared by all socket transfers and web uploads (transfers wait if all are in use)
+        'access_log': '',  # name (or path) of the JSON lines access log (empty: written to stdout)
+        'access_log_max_mb': 16,  # size in MB at which the access log is rotated
         'owner': ''  # insert a name here to personalize the webapp (e.g. 'John Doe')
     }
 
 ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz1234567890()+,.-_ '  # used to define allowed characters in directory names
 HTML = HtmlPages(CONFIG['owner'], CONFIG['language'])  # import commonly used HTML pages (to keep this file short and clear)
+COMPRESS_MIN_SIZE = 512  # smaller responses are sent uncompressed (the encoding overhead would outweigh the savings)
 
 # ----- Beginning of the main functions: ------------------------------------------------
 #
@@ -70,6 +106,53 @@ data.close()
 # __ Ensure the correctness of the target file path: __
 FILEPATH = (CONFIG['storage_path'] + '/') if (CONFIG['storage_path'] and CONFIG['storage_path'][-1] != '/') else CONFIG['storage_path']
 #
+# __ Create the TLS context shared by the webserver and the socket interface: __
+def create_ssl_context():
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(CONFIG['cert_file'], CONFIG['key_file'])
+    context.minimum_version = ssl.TLSVersion.TLSv1_2  # TLS 1.3 is negotiated whenever the client supports it
+    context.set_ciphers('ECDHE+AESGCM:ECDHE+CHACHA20')  # forward secrecy and AEAD only (TLS 1.2), TLS 1.3 suites are fixed
+    context.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_SINGLE_ECDH_USE
+    context.options &= ~ssl.OP_NO_TICKET  # keep session tickets enabled for abbreviated (1-RTT) handshakes on reconnect
+    context.num_tickets = 2  # TLS 1.3 tickets issued per handshake (allows parallel resumed connections)
+    return context
+
+
+SSL_CONTEXT = create_ssl_context()
+#
+# __ Fingerprint the icons once, so that they can be cached forever behind versioned URLs: __
+ICON_ETAGS = {}
+for icon in sorted(os.listdir('icons')):
+    with open(f'icons/{icon}', 'rb') as icon_file:
+        ICON_ETAGS[icon] = '"' + hashlib.sha1(icon_file.read()).hexdigest() + '"'
+ICON_VERSION = hashlib.sha1(''.join(ICON_ETAGS.values()).encode('utf-8')).hexdigest()[:12]
+#
+# __ Compress the static pages and the stylesheet once, instead of on every request: __
+def compress_body(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+PRECOMPRESSED = {}
+for static_page in list(vars(HTML).values()) + [STYLESHEET]:
+    PRECOMPRESSED[static_page] = {'gzip': compress_body(static_page.encode('utf-8'), 'gzip', 9)}
+    if brotli:
+        PRECOMPRESSED[static_page]['br'] = compress_body(static_page.encode('utf-8'), 'br', 11)
+#
+# __ Worker threads for batch operations (real threads, so that blocking disk I/O doesn't stall the gevent hub): __
+BATCH_POOL = ThreadPool(CONFIG.get('batch_workers', 4))
+archive.configure(CONFIG.get('zip_level', 6), None, int(CONFIG.get('unpack_max_gb', 32) * 2**30),  # uses all cores for zip files
+                  CONFIG.get('unpack_max_entries', 100000), CONFIG.get('unpack_max_ratio', 100))
+upload_writer.configure(CONFIG.get('upload_durability', 'file'), CONFIG.get('batch_workers', 4))  # writes and commits uploads
+buffer_pool.configure(CONFIG.get('socket_buffer_mb', 64) * 2**20)  # shared by socket transfers and web uploads
+#
+# __ Integrity scrub comparing all files against their stored checksums: __
+SCRUBBER = scrub.Scrubber(CONFIG.get('scrub_database', 'scrub.db'), FILEPATH, CONFIG.get('scrub_rate', 4) * 1024 * 1024)
+#
+# __ Cache of small, frequently downloaded files (served from memory with content based ETags): __
+file_cache.configure(CONFIG.get('file_cache_mb', 32) * 2**20, CONFIG.get('file_cache_max_kb', 1024) * 2**10)
+#
 # __ Increase allowed file size of uploads: __
 bottle.BaseRequest.MEMFILE_MAX = 32 * 1024 * 1024
 #
@@ -83,6 +166,35 @@ for i in range(64):
 webapp = bottle.app()
 
 
+def compression_plugin(callback):
+    # compresses all generated pages (str results) depending on the Accept-Encoding header of the client
+    def wrapper(*args, **kwargs):
+        body = callback(*args, **kwargs)
+        if not isinstance(body, str) or len(body) < COMPRESS_MIN_SIZE:
+            return body
+        bottle.response.add_header('Vary', 'Accept-Encoding')
+        accepted = [item.split(';')[0].strip() for item in bottle.request.get_header('Accept-Encoding', '').split(',')]
+        if brotli and 'br' in accepted:
+            encoding = 'br'
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+        else:
+            return body
+        bottle.response.set_header('Content-Encoding', encoding)
+        if body in PRECOMPRESSED:
+            return PRECOMPRESSED[body][encoding]
+        return compress_body(body.encode('utf-8'), encoding, 5 if encoding == 'br' else 6)
+    return wrapper
+
+
+webapp.install(compression_plugin)
+
+
+@webapp.hook('before_request')
+def note_activity():
+    scrub.note_activity()  # the scrub pauses while users are active
+
+
 @webapp.route('/')
 def to_home():
     bottle.redirect('/home')
@@ -125,34 +237,35 @@ def list_directory(directory):
             if username == USERNAMES[position] and user == (position + 1):
                 files = []
                 folders = []
-                folder_list = ''
-                file_list = ''
-                if os.path.isdir(f'{FILEPATH}users/{folder_path}'):
+                if valid_path(folder_path) and os.path.isdir(f'{FILEPATH}users/{folder_path}'):
+                    # the listing only changes if an entry of this directory is added, removed or renamed (new directory mtime)
+                    listing_etag = directory_etag(f'{FILEPATH}users/{folder_path}', user)
+                    bottle.response.set_header('ETag', listing_etag)
+                    bottle.response.set_header('Cache-Control', 'private, no-cache')
+                    if etag_matches(listing_etag):
+                        return bottle.HTTPResponse(status=304, ETag=listing_etag, Cache_Control='private, no-cache')
                     for (pth, fol, dat) in os.walk(f'{FILEPATH}users/{folder_path}'):
                         folders.extend(fol)
                         files.extend(dat)
                         break
+                    if folder_path == username and file_operations.TRASH_DIR in folders:
+                        folders.remove(file_operations.TRASH_DIR)
                     folders.sort(key=str.lower)
                     files.sort(key=str.lower)
-                    delete_dir_confirm = 'The directory will be deleted permanently. Continue?'
+                    delete_dir_confirm = 'The directory will be moved to the trash. Continue?'
                     if CONFIG['language'] == 'de':
-                        delete_dir_confirm = 'Soll der Ordner wirklich endgültig gelöscht werden?'
+                        delete_dir_confirm = 'Soll der Ordner in den Papierkorb verschoben werden?'
+                    folder_rows = []
                     for folder in folders:
-                        folder_list = folder_list + \
-                                (f'<div style="text-align:center; background-color:#59595F; font-size:16px; font-family:sans-serif">'
-                                 f'<a href="/files/{folder_path}/{folder}" style="text-decoration:none">'
-                                 f'<div style="width:500px; display:inline-block; text-align:left; color:white; border-bottom-style:solid; '
-                                 f'border-width:1px; border-color:#787878; padding:8px; vertical-align:middle">'
-                                 f'<img src="/icons/folder_32x32.png" style="vertical-align:middle"/>'
-                                 f'<span style="vertical-align:middle; margin-left:16px">{folder}'
-                                 f'</span></div></a>'
-                                 f'<a href="/deletedir/{folder_path}/{folder}" onclick="return confirm(\'{delete_dir_confirm}\');" style="text-decoration:none">'
-                                 f'<div style="width:20px; padding:8px; margin-left:8px; display:inline-block; vertical-align:middle">'
-                                 f'<img src="/icons/trash_16x16.png"/>'
-                                 f'</div></a></div>')
-                    delete_file_confirm = 'The file will be deleted permanently. Continue?'
+                        folder_rows.append(f'<div class="r"><input type="checkbox" name="items" value="{folder}" form="b" class="x"/><a href="/files/{folder_path}/{folder}"><div class="n">'
+                                           f'<img src="/icons/folder_32x32.png?v={ICON_VERSION}"/><span>{folder}</span></div></a>'
+                                           f'<a href="/deletedir/{folder_path}/{folder}" onclick="return confirm(\'{delete_dir_confirm}\');">'
+                                           f'<div class="d"><img src="/icons/trash_16x16.png?v={ICON_VERSION}"/></div></a></div>')
+                    folder_list = ''.join(folder_rows)
+                    delete_file_confirm = 'The file will be moved to the trash. Continue?'
                     if CONFIG['language'] == 'de':
-                        delete_file_confirm = 'Soll die Datei wirklich endgültig gelöscht werden?'
+                        delete_file_confirm = 'Soll die Datei in den Papierkorb verschoben werden?'
+                    file_rows = []
                     for file in files:
                         file_extension = str(file).split('.')[-1]
                         file_type = 'file'
@@ -168,65 +281,52 @@ def list_directory(directory):
                             file_type = 'music'
                         else:
                             pass
-                        file_list = file_list + \
-                                (f'<div style="text-align:center; background-color:#59595F; font-size:16px; font-family:sans-serif">'
-                                 f'<a href="/download/{folder_path}/{file}" style="text-decoration:none">'
-                                 f'<div style="width:500px; display:inline-block; text-align:left; color:white; border-bottom-style:solid; '
-                                 f'border-width:1px; border-color:#787878; padding:8px; vertical-align:middle">'
-                                 f'<img src="/icons/{file_type}_32x32.png" style="vertical-align:middle"/>'
-                                 f'<span style="vertical-align:middle; margin-left:16px">{file}'
-                                 f'</span></div></a>'
-                                 f'<a href="/deletefile/{folder_path}/{file}" onclick="return confirm(\'{delete_file_confirm}\');" style="text-decoration:none">'
-                                 f'<div style="width:20px; padding:8px; margin-left:8px; display:inline-block; vertical-align:middle">'
-                                 f'<img src="/icons/trash_16x16.png"/>'
-                                 f'</div></a></div>')
+                        file_rows.append(f'<div class="r"><input type="checkbox" name="items" value="{file}" form="b" class="x"/><a href="/download/{folder_path}/{file}"><div class="n">'
+                                         f'<img src="/icons/{file_type}_32x32.png?v={ICON_VERSION}"/><span>{file}</span></div></a>'
+                                         f'<a href="/deletefile/{folder_path}/{file}" onclick="return confirm(\'{delete_file_confirm}\');">'
+                                         f'<div class="d"><img src="/icons/trash_16x16.png?v={ICON_VERSION}"/></div></a></div>')
+                    file_list = ''.join(file_rows)
                     menu_buttons = ['Back to homepage', 'One page back', 'Download folder (zip)',
-                                    'Create directory', 'Unpack zip file here', 'Upload file']
-                    menu_placeholders = ['folder name', 'file.zip']
+                                    'Create directory', 'Unpack archive here', 'Upload file', 'Apply to selection', 'Trash']
+                    menu_placeholders = ['folder name', 'file.zip / .tar.gz', 'target folder (move, copy)']
+                    batch_operations = ['Download (zip)', 'Delete', 'Move', 'Copy']
+                    batch_confirm = 'The selected entries will be moved to the trash. Continue?'
                     if CONFIG['language'] == 'de':
                         menu_buttons = ['zur Hauptseite', 'eine Seite zurück', 'Ordner herunterladen (zip)',
-                                        'Ordner erstellen', 'zip-Datei hier entpacken', 'Datei hochladen']
-                        menu_placeholders = ['Ordnername', 'Dateiname.zip']
-                    menubar = (f'<div style="text-align:center; font-family:sans-serif; font-size:16px">'
-                               f'<a href="/files/{username}" style="text-decoration:none">'
-                               f'<div style="width:225px; margin:6px; color:black; padding:8px; border-bottom-style:solid; border-right-style:solid; '
-                               f'border-width:1px; border-color:black; display:inline-block; background-color:#787878; text-align:left; vertical-align:top">'
-                               f'<img src="/icons/home_16x16.png" style="vertical-align:middle"/>'
-                               f'<span style="vertical-align:middle; margin-left:12px">{menu_buttons[0]}'
-                               f'</span></div></a>'
-                               f'<a href="{prior_path}" style="text-decoration:none">'
-                               f'<div style="width:225px; margin:6px; color:black; padding:8px; border-bottom-style:solid; border-right-style:solid; '
-                               f'border-width:1px; border-color:black; display:inline-block; background-color:#787878; text-align:left; vertical-align:top">'
-                               f'<img src="/icons/back_16x16.png" style="vertical-align:middle"/>'
-                               f'<span style="vertical-align:middle; margin-left:12px">{menu_buttons[1]}'
-                               f'</span></div></a>'
-                               f'<a href="/zip/{folder_path}" style="text-decoration:none">'
-                               f'<div style="width:225px; margin:6px; color:black; padding:8px; border-bottom-style:solid; border-right-style:solid; '
-                               f'border-width:1px; border-color:black; display:inline-block; background-color:#787878; text-align:left; vertical-align:top">'
-                               f'<img src="/icons/download_16x16.png" style="vertical-align:middle"/>'
-                               f'<span style="vertical-align:middle; margin-left:12px">{menu_buttons[2]}'
-                               f'</span></div></a></div>'
-                               f'<div style="text-align:center; font-family:sans-serif; font-size:16px">'
-                               f'<form action="/newfolder/{folder_path}" method="post" style="width:242px; margin:6px; display:inline-block; vertical-align:top">'
-                               f'<input value="{menu_buttons[3]}" type="submit" style="width:242px; background:#787878 url(\'/icons/folder_16x16.png\') no-repeat scroll 8px; '
-                               f'font-family:sans-serif; font-size:16px; padding:8px; padding-left:36px; color:black; border-bottom-style:solid; border-right-style:solid; border-width:1px; '
-                               f'border-top-style:none; border-left-style:none; border-color:black; cursor:pointer; text-align:left" />'
-                               f'<input name="foldername" type="text" style="border-radius:4px; border-style:hidden; padding:7px; width:242px; background-color:#D8D8D8; '
-                               f'font-family:sans-serif; font-size:14px; margin-top:8px" placeholder="{menu_placeholders[0]}" required />'
+                                        'Ordner erstellen', 'Archiv hier entpacken', 'Datei hochladen', 'Auf Auswahl anwenden', 'Papierkorb']
+                        menu_placeholders = ['Ordnername', 'Dateiname.zip / .tar.gz', 'Zielordner (verschieben, kopieren)']
+                        batch_operations = ['Herunterladen (zip)', 'Löschen', 'Verschieben', 'Kopieren']
+                        batch_confirm = 'Sollen die ausgewählten Einträge in den Papierkorb verschoben werden?'
+                    menubar = (f'<div class="m">'
+                               f'<a href="/files/{username}"><div class="b">'
+                               f'<img src="/icons/home_16x16.png?v={ICON_VERSION}"/><span>{menu_buttons[0]}</span></div></a>'
+                               f'<a href="{prior_path}"><div class="b">'
+                               f'<img src="/icons/back_16x16.png?v={ICON_VERSION}"/><span>{menu_buttons[1]}</span></div></a>'
+                               f'<a href="/zip/{folder_path}"><div class="b">'
+                               f'<img src="/icons/download_16x16.png?v={ICON_VERSION}"/><span>{menu_buttons[2]}</span></div></a>'
+                               f'<a href="/trash/{username}"><div class="b">'
+                               f'<img src="/icons/trash_16x16.png?v={ICON_VERSION}"/><span>{menu_buttons[7]}</span></div></a></div>'
+                               f'<div class="m">'
+                               f'<form action="/newfolder/{folder_path}" method="post" class="f">'
+                               f'<input value="{menu_buttons[3]}" type="submit" class="fs" style="background-image:url(\'/icons/folder_16x16.png?v={ICON_VERSION}\')" />'
+                               f'<input name="foldername" type="text" class="fi" placeholder="{menu_placeholders[0]}" required />'
+                               f'</form>'
+                               f'<form action="/unpack/{folder_path}" method="post" class="f">'
+                               f'<input value="{menu_buttons[4]}" type="submit" class="fs" style="background-image:url(\'/icons/zip_16x16.png?v={ICON_VERSION}\')" />'
+                               f'<input name="zipfilename" type="text" class="fi" placeholder="{menu_placeholders[1]}" required />'
                                f'</form>'
-                               f'<form action="/unpack/{folder_path}" method="post" style="width:242px; margin:6px; display:inline-block; vertical-align:top">'
-                               f'<input value="{menu_buttons[4]}" type="submit" style="width:242px; background:#787878 url(\'/icons/zip_16x16.png\') no-repeat scroll 8px; '
-                               f'font-family:sans-serif; font-size:16px; padding:8px; padding-left:36px; color:black; border-bottom-style:solid; border-right-style:solid; border-width:1px; '
-                               f'border-top-style:none; border-left-style:none; border-color:black; cursor:pointer; text-align:left" />'
-                               f'<input name="zipfilename" type="text" style="border-radius:4px; border-style:hidden; padding:7px; width:242px; background-color:#D8D8D8; '
-                               f'font-family:sans-serif; font-size:14px; margin-top:8px" placeholder="{menu_placeholders[1]}" required />'
+                               f'<form action="/upload/{folder_path}" method="post" class="f" enctype="multipart/form-data">'
+                               f'<input value="{menu_buttons[5]}" type="submit" class="fs" style="background-image:url(\'/icons/upload_16x16.png?v={ICON_VERSION}\')" />'
+                               f'<input name="filename" type="file" class="fi ff" required />'
                                f'</form>'
-                               f'<form action="/upload/{folder_path}" method="post" style="width:242px; margin:6px; display:inline-block; vertical-align:top" enctype="multipart/form-data">'
-                               f'<input value="{menu_buttons[5]}" type="submit" style="width:242px; background:#787878 url(\'/icons/upload_16x16.png\') no-repeat scroll 8px; '
-                               f'font-family:sans-serif; font-size:16px; padding:8px; padding-left:36px; color:black; border-bottom-style:solid; border-right-style:solid; border-width:1px; '
-                               f'border-top-style:none; border-left-style:none; border-color:black; cursor:pointer; text-align:left" />'
-                               f'<input name="filename" type="file" style="border-radius:4px; border-style:hidden; padding:4px; width:242px; background-color:#D8D8D8; '
-                               f'font-family:sans-serif; font-size:14px; margin-top:8px" required />'
+                               f'<form id="b" action="/batch/{folder_path}" method="post" class="f" '
+                               f'onsubmit="return this.operation.value != \'delete\' || confirm(\'{batch_confirm}\');">'
+                               f'<input value="{menu_buttons[6]}" type="submit" class="fs fn" />'
+                               f'<select name="operation" class="fi"><option value="download">{batch_operations[0]}</option>'
+                               f'<option value="delete">{batch_operations[1]}</option><option value="move">{batch_operations[2]}</option>'
+                               f'<option value="copy">{batch_operations[3]}</option></select>'
+                               f'<input name="target" type="text" class="fi" placeholder="{menu_placeholders[2]}" />'
+                               f'<input name="redirect" type="hidden" value="1" />'
                                f'</form></div>')
 
                     show_path = ''
@@ -239,22 +339,15 @@ def list_directory(directory):
                         <head>
                             <meta charset="utf-8">
                             <title>{header_language[0]}</title>
+                            {STYLESHEET_LINK}
                         </head>
-                        <body style="background-color:#59595F">
-                            <h1 style="font-family:sans-serif; font-size:24px; text-align:center; font-weight:bold; color:black; background-color:#88DD3A; 
-                            border-radius:10px; margin:16px; margin-bottom:32px; padding:8px; box-shadow:2px 2px 4px #262626">
-                                ~ / {header_language[1]} / {show_path}...
-                            </h1>
+                        <body>
+                            <h1 class="h">~ / {header_language[1]} / {show_path}...</h1>
                             {menubar}<br>
                             {folder_list}<br><br>
                             {file_list}<br><br>
-                            <p style="margin:auto; font-family:sans-serif; font-size:16px; text-align:center; color:white">
-                                {len(folders)} {header_language[2]}, {len(files)} {header_language[3]}
-                            </p><br><br><br>
-                            <p style="margin:auto; font-family:sans-serif; font-size:12px; text-align:center; color:#787878; border-top-style:solid; 
-                            border-color:#787878; border-width:1px; width:250px; padding:10px">
-                                - {CONFIG["owner"]} RaspiNAS {header_language[4]} {VERSION} -
-                            </p>
+                            <p class="c">{len(folders)} {header_language[2]}, {len(files)} {header_language[3]}</p><br><br><br>
+                            <p class="v">- {CONFIG["owner"]} RaspiNAS {header_language[4]} {VERSION} -</p>
                         </body>
                     '''
                 else:
@@ -271,6 +364,18 @@ def download_file(filepath):
         directory = '/'.join(str(filepath).split('/')[:-1])
         for position in range(len(USERNAMES)):
             if username == USERNAMES[position] and user == (position + 1):
+                if valid_path(str(filepath)) and os.path.isfile(f'{FILEPATH}users/{filepath}') and not bottle.request.get_header('Range'):
+                    cached = file_cache.get(f'{FILEPATH}users/{filepath}')
+                    if cached:
+                        data, etag, mtime = cached
+                        if etag_matches(etag):
+                            return bottle.HTTPResponse(status=304, ETag=etag)
+                        mimetype = mimetypes.guess_type(file)[0] or 'application/octet-stream'
+                        if mimetype.startswith('text/'):
+                            mimetype += '; charset=UTF-8'  # same as bottle.static_file
+                        return bottle.HTTPResponse(data, Content_Type=mimetype,
+                                                   Content_Disposition=f'attachment; filename="{file}"', Content_Length=len(data),
+                                                   ETag=etag, Last_Modified=bottle.http_date(mtime), Accept_Ranges='bytes')
                 return bottle.static_file(file, root=f'{FILEPATH}users/{directory}', download=file)
     return HTML.AccessDenied
 
@@ -284,9 +389,11 @@ def download_zip(zippath):
         folder_name = directory.split('/')[-1]
         for position in range(len(USERNAMES)):
             if username == USERNAMES[position] and user == (position + 1):
+                if not valid_path(directory) or not os.path.isdir(f'{FILEPATH}users/{directory}'):
+                    return HTML.NoDirectory
                 if os.path.isfile(f'{FILEPATH}temp/{username}/{folder_name}.zip'):
                     os.remove(f'{FILEPATH}temp/{username}/{folder_name}.zip')
-                shutil.make_archive(f'{FILEPATH}temp/{username}/{folder_name}', 'zip', f'{FILEPATH}users/{directory}')
+                archive.make_zip(f'{FILEPATH}temp/{username}/{folder_name}.zip', f'{FILEPATH}users/{directory}', directory == username)
                 # subprocess.run(f'zip -r {FILEPATH}temp/{username}/{folder_name}.zip {FILEPATH}users/{directory}/', shell=True, stdout=subprocess.DEVNULL)
                 return bottle.static_file(f'{folder_name}.zip', root=f'{FILEPATH}temp/{username}', download=f'{folder_name}.zip')
     return HTML.AccessDenied
@@ -304,9 +411,8 @@ def delete_directory(deldirectorypath):
             return
         for position in range(len(USERNAMES)):
             if username == USERNAMES[position] and user == (position + 1):
-                if os.path.isdir(f'{FILEPATH}users/{directory}'):
-                    shutil.rmtree(f'{FILEPATH}users/{directory}')
-                    # subprocess.run(f'rm -rf {FILEPATH}users/{directory}', shell=True, stdout=subprocess.DEVNULL)
+                if valid_path(directory) and os.path.isdir(f'{FILEPATH}users/{directory}'):
+                    file_operations.move_to_trash(f'{FILEPATH}users/{directory}', trash_path(username), directory)
                     bottle.redirect(f'/files/{prior_folder}')
                 else:
                     return HTML.NoDirectory
@@ -322,8 +428,8 @@ def delete_file(delfilepath):
         username = filepath.split('/')[0]
         for position in range(len(USERNAMES)):
             if username == USERNAMES[position] and user == (position + 1):
-                if os.path.isfile(f'{FILEPATH}users/{filepath}'):
-                    os.remove(f'{FILEPATH}users/{filepath}')
+                if valid_path(filepath) and os.path.isfile(f'{FILEPATH}users/{filepath}'):
+                    file_operations.move_to_trash(f'{FILEPATH}users/{filepath}', trash_path(username), filepath)
                     bottle.redirect(f'/files/{folder}')
                 else:
                     return HTML.NoFile
@@ -360,42 +466,81 @@ def create_directory(parentpath):
 def unpack_zipfile(ziptarget):
     user = check_login()
     if user:
-        zipfile = str(bottle.request.forms.get('zipfilename'))
-        folder_name = '.'.join(zipfile.split('.')[:-1])
+        archive_name = str(bottle.request.forms.decode().get('zipfilename'))
+        suffix = archive.unpack_suffix(archive_name)
+        folder_name = archive_name[:-len(suffix)] if suffix else ''
         target_folder = str(ziptarget)
         username = target_folder.split('/')[0]
         for position in range(len(USERNAMES)):
             if username == USERNAMES[position] and user == (position + 1):
-                if os.path.isfile(f'{FILEPATH}users/{target_folder}/{zipfile}') and \
-                        not os.path.isdir(f'{FILEPATH}users/{target_folder}/{folder_name}') and \
-                        zipfile.split('.')[-1] == 'zip':
-                    os.mkdir(f'{FILEPATH}users/{target_folder}/{folder_name}')
-                    shutil.unpack_archive(f'{FILEPATH}users/{target_folder}/{zipfile}', f'{FILEPATH}users/{target_folder}/{folder_name}', 'zip')
-                    # subprocess.run(f'unzip {FILEPATH}users/{target_folder}/{zipfile} -d {FILEPATH}users/{target_folder}/{folder_name}', shell=True, stdout=subprocess.DEVNULL)
-                    bottle.redirect(f'/files/{target_folder}/{folder_name}')
+                if os.path.isfile(f'{FILEPATH}users/{target_folder}/{archive_name}') and '/' not in archive_name and \
+                        valid_path(f'{target_folder}/{folder_name}') and not os.path.lexists(f'{FILEPATH}users/{target_folder}/{folder_name}'):
+                    # the archive is extracted in the background, the progress page redirects to the new folder when it is done
+                    job_id = archive.start_unpack_job(f'{FILEPATH}users/{target_folder}/{archive_name}', f'{FILEPATH}users/{target_folder}/{folder_name}',
+                                                      username, f'{target_folder}/{folder_name}')
+                    # subprocess.run(f'unzip {FILEPATH}users/{target_folder}/{archive_name} -d {FILEPATH}users/{target_folder}/{folder_name}', shell=True, stdout=subprocess.DEVNULL)
+                    bottle.redirect(f'/unpacking/{job_id}')
                 else:
-                    error_language = ['Unpacking failed', 'Error: The given file does not exist or the target directory is not empty.', 'Back']
-                    if CONFIG['language'] == 'de':
-                        error_language = ['Entpacken fehlgeschlagen', 'Fehler: die angegebene Datei existiert nicht oder das Zielverzeichnis ist nicht leer.', 'Zurück']
-                    return f'''
-                        <head>
-                            <meta charset="utf-8">
-                            <title>{error_language[0]}</title>
-                        </head>
-                        <body style="background-color:#59595F">
-                            <p style="margin:auto; font-family:sans-serif; font-size:14px; text-align:center; color:black; 
-                            background-color:#FF4C4C; border-radius:4px; margin-top:32px; padding:8px; width:400px">
-                                {error_language[1]}
-                            </p>
-                            <form action="/files/{target_folder}" style="margin:auto; width:250px; height:100px; background-color:#59595F">
-                                <input value="{error_language[2]}" type="submit" style="position:relative; left:50px; font-family:sans-serif; font-size:14px; text-align:center; width:150px; 
-                                color:black; background-color:#88DD3A; border-radius:4px; border-style:hidden; margin-top:32px; padding:8px; box-shadow:2px 2px 4px #262626" />
-                            </form>
-                        </body>
-                    '''
+                    return unpack_error(target_folder)
+    return HTML.AccessDenied
+
+
+@webapp.route('/unpacking/<job_id>')
+def unpack_progress(job_id):
+    user = check_login()
+    if user:
+        job = file_operations.get_job(str(job_id), USERNAMES[user - 1])
+        if job is None or 'target' not in job:
+            bottle.abort(404, 'Unknown job')
+        target_folder = '/'.join(job['target'].split('/')[:-1])
+        if job['status'] == 'done':
+            bottle.redirect(f'/files/{job["target"]}')
+        if job['status'] == 'failed':
+            return unpack_error(target_folder, job['error'])
+        progress_language = ['Unpacking', 'files', 'Back']
+        if CONFIG['language'] == 'de':
+            progress_language = ['Entpacken', 'Dateien', 'Zurück']
+        return f'''
+            <head>
+                <meta charset="utf-8">
+                <meta http-equiv="refresh" content="1">
+                <title>{progress_language[0]}</title>
+                {STYLESHEET_LINK}
+            </head>
+            <body>
+                <h1 class="h">{progress_language[0]}: {job['target'].split('/')[-1]} ...</h1>
+                <p class="c">{job['files_done']} / {job['files_total']} {progress_language[1]}, {job['bytes_done'] // 2**20} / {job['bytes_total'] // 2**20} MB</p>
+                <form action="/files/{target_folder}" class="rf">
+                    <input value="{progress_language[2]}" type="submit" class="rb" />
+                </form>
+            </body>
+        '''
     return HTML.AccessDenied
 
 
+def unpack_error(target_folder, reason=None):
+    error_language = ['Unpacking failed', 'Error: The given file does not exist, is no supported archive (zip, tar, tar.gz, tar.bz2, tar.xz) '
+                                          'or the target directory is not empty.', 'Back']
+    if CONFIG['language'] == 'de':
+        error_language = ['Entpacken fehlgeschlagen', 'Fehler: die angegebene Datei existiert nicht, ist kein unterstütztes Archiv '
+                                                      '(zip, tar, tar.gz, tar.bz2, tar.xz) oder das Zielverzeichnis ist nicht leer.', 'Zurück']
+    if reason:
+        error_language[1] = f'{error_language[0]}: {reason}'
+    return f'''
+        <head>
+            <meta charset="utf-8">
+            <title>{error_language[0]}</title>
+            {STYLESHEET_LINK}
+        </head>
+        <body>
+            <p class="e">{error_language[1]}</p>
+            <form action="/files/{target_folder}" class="rf">
+                <input value="{error_language[2]}" type="submit" class="rb" />
+            </form>
+        </body>
+    '''
+
+
 @webapp.route('/upload/<targetpath:path>', method='POST')
 def upload_file(targetpath):
     user = check_login()
@@ -413,19 +558,310 @@ def upload_file(targetpath):
                         name_parts[-2] = name_parts[-2][:-3]
                     name_parts[-2] = name_parts[-2] + f'({copy_count})'
                     new_file.filename = '.'.join(name_parts)
-                new_file.save(f'{FILEPATH}users/{target_folder}')
+                # staged, preallocated and committed atomically, so that interrupted uploads never appear as truncated files
+                new_file.file.seek(0, os.SEEK_END)
+                upload_length = new_file.file.tell()
+                new_file.file.seek(0)
+                staged_file = upload_writer.StagedFile(f'{FILEPATH}users/{target_folder}/{new_file.filename}', f'{FILEPATH}users/{username}', upload_length)
+                try:
+                    upload_writer.write_stream(staged_file, new_file.file.readinto, upload_length)
+                    staged_file.commit()
+                except Exception:
+                    staged_file.discard()
+                    raise
+                file_cache.invalidate(f'{FILEPATH}users/{target_folder}/{new_file.filename}')
                 bottle.redirect(f'/files/{target_folder}')
     return HTML.AccessDenied
 
 
+@webapp.route('/batch/<batchpath:path>', method='POST')
+def batch_operation(batchpath):
+    user = check_login()
+    if user:
+        directory = str(batchpath)
+        username = directory.split('/')[0]
+        forms = bottle.request.forms.decode()
+        operation = forms.get('operation')
+        items = forms.getall('items')
+        jobs = {}
+        for position in range(len(USERNAMES)):
+            if username == USERNAMES[position] and user == (position + 1):
+                if not valid_path(directory) or not os.path.isdir(f'{FILEPATH}users/{directory}'):
+                    return HTML.NoDirectory
+                failed = {item: 'invalid name' for item in items if '/' in item or not valid_path(f'{directory}/{item}')}
+                items = [item for item in items if item not in failed]
+                if operation == 'download':
+                    folder_name = directory.split('/')[-1]
+                    bottle.response.content_type = 'application/zip'
+                    bottle.response.set_header('Content-Disposition', f'attachment; filename="{folder_name}.zip"')
+                    return stream_archive(f'{FILEPATH}users/{directory}', items, username)
+                elif operation == 'delete':
+                    results = BATCH_POOL.map(lambda item: batch_delete(directory, item), items)
+                elif operation in ['move', 'copy']:
+                    target = (username + '/' + str(forms.get('target', '')).strip('/')).rstrip('/')
+                    if not valid_path(target) or not os.path.isdir(f'{FILEPATH}users/{target}'):
+                        return HTML.NoDirectory
+                    failed.update({item: 'target inside source' for item in items if f'{target}/{item}/'.startswith(f'{directory}/{item}/')})
+                    items = [item for item in items if item not in failed]
+                    if operation == 'move':
+                        results = BATCH_POOL.map(lambda item: batch_move(f'{FILEPATH}users/{directory}', f'{FILEPATH}users/{target}', item), items)
+                    else:
+                        folders = [item for item in items if os.path.isdir(f'{FILEPATH}users/{directory}/{item}')]
+                        results = BATCH_POOL.map(lambda item: batch_copy(f'{FILEPATH}users/{directory}', f'{FILEPATH}users/{target}', item),
+                                                 [item for item in items if item not in folders])
+                        for item in folders:  # copy jobs are started from the request greenlet (the pool threads don't run a gevent hub)
+                            try:
+                                jobs[item] = file_operations.start_copy_job(f'{FILEPATH}users/{directory}/{item}', f'{FILEPATH}users/{target}/{item}', username)
+                            except OSError as e:
+                                results.append((item, e.strerror or str(e)))
+                else:
+                    bottle.abort(400, f'Invalid batch operation ({operation})')
+                for item, error in results:
+                    if error:
+                        failed[item] = error
+                if forms.get('redirect') and not failed and not jobs:
+                    bottle.redirect(f'/files/{directory}')
+                return {'operation': operation, 'succeeded': [item for item in items if item not in failed], 'failed': failed, 'jobs': jobs}
+    return HTML.AccessDenied
+
+
+@webapp.route('/rename/<renamepath:path>', method='POST')
+def rename_entry(renamepath):
+    user = check_login()
+    if user:
+        source = str(renamepath)
+        username = source.split('/')[0]
+        new_name = str(bottle.request.forms.decode().get('newname', ''))
+        folder = '/'.join(source.split('/')[:-1])
+        for position in range(len(USERNAMES)):
+            if username == USERNAMES[position] and user == (position + 1):
+                if not valid_path(source) or len(source.split('/')) < 2 or '/' in new_name or not valid_path(f'{folder}/{new_name}'):
+                    bottle.abort(400, 'Invalid file or folder name')
+                if not os.path.exists(f'{FILEPATH}users/{source}'):
+                    return HTML.NoFile
+                try:
+                    file_operations.move_entry(f'{FILEPATH}users/{source}', f'{FILEPATH}users/{folder}/{new_name}')
+                except FileExistsError:
+                    bottle.abort(409, 'The target already exists')
+                bottle.redirect(f'/files/{folder}')
+    return HTML.AccessDenied
+
+
+@webapp.route('/move/<movepath:path>', method='POST')
+@webapp.route('/copy/<movepath:path>', method='POST')
+def move_or_copy_entry(movepath):
+    user = check_login()
+    if user:
+        source = str(movepath)
+        username = source.split('/')[0]
+        target_folder = (username + '/' + str(bottle.request.forms.decode().get('target', '')).strip('/')).rstrip('/')
+        target = f'{target_folder}/{source.split("/")[-1]}'
+        for position in range(len(USERNAMES)):
+            if username == USERNAMES[position] and user == (position + 1):
+                if not valid_path(source) or len(source.split('/')) < 2 or not valid_path(target_folder):
+                    bottle.abort(400, 'Invalid file or folder name')
+                if not os.path.exists(f'{FILEPATH}users/{source}'):
+                    return HTML.NoFile
+                if not os.path.isdir(f'{FILEPATH}users/{target_folder}') or f'{target}/'.startswith(f'{source}/'):
+                    return HTML.NoDirectory
+                try:
+                    if bottle.request.path.startswith('/move/'):
+                        file_operations.move_entry(f'{FILEPATH}users/{source}', f'{FILEPATH}users/{target}')
+                    elif os.path.isdir(f'{FILEPATH}users/{source}'):  # folders are copied in the background
+                        return {'job': file_operations.start_copy_job(f'{FILEPATH}users/{source}', f'{FILEPATH}users/{target}', username)}
+                    else:
+                        file_operations.copy_file(f'{FILEPATH}users/{source}', f'{FILEPATH}users/{target}')
+                except FileExistsError:
+                    bottle.abort(409, 'The target already exists')
+                bottle.redirect(f'/files/{target_folder}')
+    return HTML.AccessDenied
+
+
+@webapp.route('/jobs/<job_id>')
+def job_status(job_id):
+    user = check_login()
+    if user:
+        job = file_operations.get_job(str(job_id), USERNAMES[user - 1])
+        if job:
+            return job
+        bottle.abort(404, 'Unknown job')
+    return HTML.AccessDenied
+
+
+@webapp.route('/trash/<username>')
+def list_trash(username):
+    user = check_login()
+    if user:
+        for position in range(len(USERNAMES)):
+            if username == USERNAMES[position] and user == (position + 1):
+                trash_language = [f'{username}\'s trash', 'trash', 'Back to files', 'entries',
+                                  f'Entries are deleted permanently after {CONFIG.get("trash_retention_days", 7)} day(s). Click an entry to restore it.']
+                if CONFIG['language'] == 'de':
+                    trash_language = [f'Papierkorb von {username}', 'Papierkorb', 'zurück zu den Dateien', 'Einträge',
+                                      f'Einträge werden nach {CONFIG.get("trash_retention_days", 7)} Tag(en) endgültig gelöscht. Zum Wiederherstellen anklicken.']
+                entry_rows = []
+                for entry in file_operations.list_trash(trash_path(username)):
+                    deleted = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['deleted']))
+                    entry_rows.append(f'<div class="r"><a href="/restore/{username}/{entry["id"]}"><div class="n">'
+                                      f'<img src="/icons/back_16x16.png?v={ICON_VERSION}"/><span>{entry["origin"]} ({deleted})</span></div></a></div>')
+                return f'''
+                    <head>
+                        <meta charset="utf-8">
+                        <title>{trash_language[0]}</title>
+                        {STYLESHEET_LINK}
+                    </head>
+                    <body>
+                        <h1 class="h">~ / {trash_language[1]} / ...</h1>
+                        <div class="m"><a href="/files/{username}"><div class="b">
+                        <img src="/icons/home_16x16.png?v={ICON_VERSION}"/><span>{trash_language[2]}</span></div></a></div><br>
+                        <p class="c">{trash_language[4]}</p><br>
+                        {''.join(entry_rows)}<br><br>
+                        <p class="c">{len(entry_rows)} {trash_language[3]}</p>
+                    </body>
+                '''
+    return HTML.AccessDenied
+
+
+@webapp.route('/restore/<username>/<entry_id>')
+def restore_entry(username, entry_id):
+    user = check_login()
+    if user:
+        for position in range(len(USERNAMES)):
+            if username == USERNAMES[position] and user == (position + 1):
+                for entry in file_operations.list_trash(trash_path(username)):
+                    if entry['id'] == entry_id:
+                        try:
+                            file_operations.restore_from_trash(trash_path(username), entry_id, f'{FILEPATH}users/{entry["origin"]}')
+                        except FileExistsError:
+                            bottle.abort(409, 'The original location is already in use')
+                        bottle.redirect(f'/files/{"/".join(entry["origin"].split("/")[:-1])}')
+                return HTML.NoFile
+    return HTML.AccessDenied
+
+
+@webapp.route('/admin/scrub')
+def scrub_status():
+    user = check_login()
+    if user and USERNAMES[user - 1] in CONFIG.get('admin_users', []):
+        status = SCRUBBER.status()
+        scrub_language = ['Integrity scrub', 'scrub', 'checked files', 'current position', 'last complete pass', 'checksum mismatches', 'none', 'disabled']
+        if CONFIG['language'] == 'de':
+            scrub_language = ['Integritätsprüfung', 'Prüfung', 'geprüfte Dateien', 'aktuelle Position', 'letzter vollständiger Durchlauf',
+                              'Prüfsummenfehler', 'keiner', 'deaktiviert']
+        last_pass = scrub_language[6]
+        if status.get('pass_completed'):
+            last_pass = time.strftime('%Y-%m-%d %H:%M', time.localtime(float(status['pass_completed'])))
+        if not CONFIG.get('scrub_rate', 4):
+            last_pass = scrub_language[7]
+        mismatch_rows = []
+        for path, detected in status['mismatches']:
+            mismatch_rows.append(f'<div class="r"><a href="/download/{path}"><div class="n"><img src="/icons/file_32x32.png?v={ICON_VERSION}"/>'
+                                 f'<span>{path} ({time.strftime("%Y-%m-%d %H:%M", time.localtime(detected))})</span></div></a></div>')
+        return f'''
+            <head>
+                <meta charset="utf-8">
+                <title>{scrub_language[0]}</title>
+                {STYLESHEET_LINK}
+            </head>
+            <body>
+                <h1 class="h">~ / admin / {scrub_language[1]} / ...</h1>
+                <p class="c">{scrub_language[2]}: {status['files']}</p>
+                <p class="c">{scrub_language[3]}: {status.get('cursor') or '-'}</p>
+                <p class="c">{scrub_language[4]}: {last_pass}</p><br>
+                <p class="c">{scrub_language[5]}: {len(mismatch_rows)}</p><br>
+                {''.join(mismatch_rows)}
+            </body>
+        '''
+    return HTML.AccessDenied
+
+
+@webapp.route('/admin/buffers')
+def buffer_status():
+    user = check_login()
+    if user and USERNAMES[user - 1] in CONFIG.get('admin_users', []):
+        stats = buffer_pool.stats()
+        buffer_language = ['Socket buffers', 'buffers', 'buffers in use', 'highest usage', 'waiting transfers', 'total wait time', 'longest wait time']
+        if CONFIG['language'] == 'de':
+            buffer_language = ['Socket-Puffer', 'Puffer', 'belegte Puffer', 'höchste Belegung', 'wartende Übertragungen', 'gesamte Wartezeit', 'längste Wartezeit']
+        return f'''
+            <head>
+                <meta charset="utf-8">
+                <title>{buffer_language[0]}</title>
+                {STYLESHEET_LINK}
+            </head>
+            <body>
+                <h1 class="h">~ / admin / {buffer_language[1]} / ...</h1>
+                <p class="c">{buffer_language[2]}: {stats['in_use']} / {stats['buffers']} ({stats['buffer_size'] // 2**20} MB)</p>
+                <p class="c">{buffer_language[3]}: {stats['peak']}</p>
+                <p class="c">{buffer_language[4]}: {stats['waits']}</p>
+                <p class="c">{buffer_language[5]}: {stats['wait_time']} s</p>
+                <p class="c">{buffer_language[6]}: {stats['max_wait']} s</p>
+            </body>
+        '''
+    return HTML.AccessDenied
+
+
+@webapp.route('/admin/cache')
+def cache_status():
+    user = check_login()
+    if user and USERNAMES[user - 1] in CONFIG.get('admin_users', []):
+        stats = file_cache.stats()
+        cache_language = ['File cache', 'cache', 'cached files', 'memory used', 'hits', 'misses', 'evictions', 'disabled']
+        if CONFIG['language'] == 'de':
+            cache_language = ['Datei-Cache', 'Cache', 'zwischengespeicherte Dateien', 'belegter Speicher', 'Treffer', 'Fehlschläge', 'Verdrängungen', 'deaktiviert']
+        if stats is None:
+            rows = f'<p class="c">{cache_language[7]}</p>'
+        else:
+            hit_rate = round(100 * stats['hits'] / max(stats['hits'] + stats['misses'], 1), 1)
+            rows = (f'<p class="c">{cache_language[2]}: {stats["files"]}</p>'
+                    f'<p class="c">{cache_language[3]}: {stats["used"] // 2**20} / {stats["budget"] // 2**20} MB</p>'
+                    f'<p class="c">{cache_language[4]}: {stats["hits"]} ({hit_rate} %)</p>'
+                    f'<p class="c">{cache_language[5]}: {stats["misses"]}</p>'
+                    f'<p class="c">{cache_language[6]}: {stats["evictions"]}</p>')
+        return f'''
+            <head>
+                <meta charset="utf-8">
+                <title>{cache_language[0]}</title>
+                {STYLESHEET_LINK}
+            </head>
+            <body>
+                <h1 class="h">~ / admin / {cache_language[1]} / ...</h1>
+                {rows}
+            </body>
+        '''
+    return HTML.AccessDenied
+
+
 @webapp.route('/favicon.ico')
 def favicon():
-    bottle.redirect('/icons/favicon.ico')
+    bottle.redirect(f'/icons/favicon.ico?v={ICON_VERSION}')
+
+
+@webapp.route('/style.css')
+def get_stylesheet():
+    bottle.response.content_type = 'text/css; charset=utf-8'
+    bottle.response.set_header('ETag', f'W/"{STYLESHEET_VERSION}"')  # weak, because the body is sent with different encodings
+    if bottle.request.query.get('v') == STYLESHEET_VERSION:
+        bottle.response.set_header('Cache-Control', 'public, max-age=31536000, immutable')
+    if etag_matches(f'W/"{STYLESHEET_VERSION}"'):
+        return bottle.HTTPResponse(status=304, ETag=f'W/"{STYLESHEET_VERSION}"')
+    return STYLESHEET
 
 
 @webapp.route('/icons/<image>')
 def get_icon(image):
-    return bottle.static_file(image, root='icons')
+    if image not in ICON_ETAGS:
+        return bottle.static_file(image, root='icons')
+    if bottle.request.query.get('v') == ICON_VERSION:  # versioned URLs never change their content
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=86400'
+    if etag_matches(ICON_ETAGS[image]):
+        return bottle.HTTPResponse(status=304, ETag=ICON_ETAGS[image], Cache_Control=cache_control)
+    icon = bottle.static_file(image, root='icons')
+    icon.set_header('ETag', ICON_ETAGS[image])
+    icon.set_header('Cache-Control', cache_control)
+    return icon
 
 
 def check_login():
@@ -433,31 +869,119 @@ def check_login():
     if hashed_credentials:
         for position in range(len(USERDATA)):
             if hashed_credentials == USERDATA[position]:
+                bottle.request.environ['raspinas.user'] = USERNAMES[position]  # used by the access log
                 return position + 1
     return 0
 
 
+def valid_path(path):
+    # rejects empty path segments, references to parent directories and paths into the trash of a user
+    parts = path.split('/')
+    return all(part not in ['', '.', '..'] for part in parts) and parts[1:2] != [file_operations.TRASH_DIR]
+
+
+def trash_path(username):
+    return f'{FILEPATH}users/{username}/{file_operations.TRASH_DIR}'
+
+
+def batch_delete(directory, item):
+    try:
+        file_operations.move_to_trash(f'{FILEPATH}users/{directory}/{item}', trash_path(directory.split('/')[0]), f'{directory}/{item}')
+    except OSError as e:
+        return item, e.strerror or str(e)
+    return item, None
+
+
+def batch_move(directory, target, item):
+    try:
+        file_operations.move_entry(f'{directory}/{item}', f'{target}/{item}')
+    except OSError as e:
+        return item, e.strerror or str(e)
+    return item, None
+
+
+def batch_copy(directory, target, item):
+    try:
+        file_operations.copy_file(f'{directory}/{item}', f'{target}/{item}')
+    except OSError as e:
+        return item, e.strerror or str(e)
+    return item, None
+
+
+def stream_archive(directory, items, username):
+    # creates the zip archive on the fly, so that neither a temporary file nor the whole archive in memory is needed
+    entries = []
+    for item in items:
+        if os.path.isdir(f'{directory}/{item}'):
+            entries.extend(archive.directory_entries(f'{directory}/{item}', item))
+        elif os.path.isfile(f'{directory}/{item}'):
+            entries.append((f'{directory}/{item}', item))
+    return archive.zip_stream(entries, f'{FILEPATH}temp/{username}')
+
+
+def directory_etag(directory, user):
+    stats = os.stat(directory)
+    fingerprint = f'{stats.st_ino}-{stats.st_mtime_ns}-{user}-{CONFIG["language"]}-{VERSION}-{ICON_VERSION}-{STYLESHEET_VERSION}'
+    return 'W/"' + hashlib.sha1(fingerprint.encode('utf-8')).hexdigest() + '"'
+
+
+def etag_matches(etag):
+    if_none_match = bottle.request.get_header('If-None-Match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # weak comparison as required for If-None-Match (RFC 9110, 13.1.2)
+    return etag.removeprefix('W/') in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+
+
 def background_task():
     while True:
         thread_wait.wait(21600)
         for name in USERNAMES:
             for temp_file in os.listdir(f'{FILEPATH}temp/{name}'):
                 os.remove(f'{FILEPATH}temp/{name}/{temp_file}')
+        file_operations.prune_jobs()
+
+
+def trash_task():
+    retention = CONFIG.get('trash_retention_days', 7) * 86400
+    rate = CONFIG.get('trash_purge_rate', 16) * 1024 * 1024
+    while True:
+        thread_wait.wait(900)
+        for name in USERNAMES:
+            try:  # the purge must never stop, otherwise the trash grows until the next restart
+                file_operations.purge_trash(trash_path(name), retention, rate)
+            except Exception as e:
+                access_log.log('error', source='trash', user=name, event='purge failed', error=str(e))
 
 
 def start_socket_interface():
-    socket_interface.socket_server(CONFIG['host_ip'], CONFIG['socket_port'], USERNAMES, USERDATA, FILEPATH)
+    socket_interface.socket_server(CONFIG['host_ip'], CONFIG['socket_port'], USERNAMES, USERDATA, FILEPATH,
+                                   SSL_CONTEXT if CONFIG.get('socket_tls', True) else None, CONFIG.get('socket_checksums', ['sha384', 'blake2b']),
+                                   int(CONFIG.get('socket_token_hours', 24) * 3600))
 
 
+#
+# __ Remove uploads that were interrupted by a crash or power loss: __
+for name in USERNAMES:
+    upload_writer.clean_staging(f'{FILEPATH}users/{name}')
+#
+# __ Start the access log writer: __
+access_log.start(CONFIG.get('access_log', ''), CONFIG.get('access_log_max_mb', 16) * 1024 * 1024)
 #
 # __ Start garbage-collector thread: __
 thread_wait = threading.Event()
 background_thread = threading.Thread(target=background_task, daemon=True)
 background_thread.start()
+trash_thread = threading.Thread(target=trash_task, daemon=True)
+trash_thread.start()
+if CONFIG.get('scrub_rate', 4) > 0:
+    SCRUBBER.start()
 #
 # __ Start gui server to receive data from the frontend: __
 socket_thread = threading.Thread(target=start_socket_interface, daemon=True)
 socket_thread.start()
 #
 # __ Start the webserver: __
-bottle.run(webapp, server='gevent', host=CONFIG['host_ip'], port=CONFIG['port'], certfile=CONFIG['cert_file'], keyfile=CONFIG['key_file'])
+bottle.run(access_log.RequestLogger(webapp), server='gevent', host=CONFIG['host_ip'], port=CONFIG['port'], ssl_context=SSL_CONTEXT, quiet=True)
@@ -14,16 +14,49 @@
 # If not, see <https://www.gnu.org/licenses/>.
 
 import os
+import ssl
+import json
+import time
+import zlib
+import contextlib
 import socket
 import struct
-import shutil
+import secrets
 import hashlib
+import hmac
 import threading
+import access_log
+import file_operations
+import file_cache
+import upload_writer
+import scrub
+import archive
+import buffer_pool
 
 # Constants
-BUFFER = 2**27  # Max packet or file buffer size to be cached in RAM (128 MB)
+DATA_LIMIT = 2**24  # Max size of sync manifests and data responses, which are held in RAM completely (16 MB) and counted against the buffer pool
+COMMAND_LIMIT = 2**16  # Max size of all other data packets (64 KB), files are transferred through the buffer pool
+LOGIN_LIMIT = 2**12  # Max size of the login data (received before the client is authenticated)
+BLOCK_SIZE = 2**24  # Default block size of CMD_GET_BLOCKS (16 MB), clients may choose between MIN_BLOCK_SIZE and MAX_BLOCK_SIZE
+MIN_BLOCK_SIZE = 2**16
+MAX_BLOCK_SIZE = 2**30
 RETRY_COUNT = 5  # Max number of loop passes before an error is raised (must be a positive integer)
 SEPARATOR = "\n"
+BENCHMARK_SIZE = 2**26  # Amount of data hashed per algorithm by the checksum benchmark (64 MB)
+TOKEN_SECRET = secrets.token_bytes(32)  # Signs the resume tokens (a restart invalidates all tokens)
+
+# Server-side revocation of resume tokens
+REVOKED_TOKENS = dict()  # token id -> expiry time (kept until the token would have expired anyway)
+REVOKED_BEFORE = dict()  # user name -> all tokens of the user issued before this time are invalid
+
+try:  # Optional fast checksums for trusted networks
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
 
 # Communication Protocol:
 # SERVER        CLIENT
@@ -38,7 +71,15 @@ SEPARATOR = "\n"
 # Send data                     Receive data                Length specified in header  |
 # Receive check response        Send check response         2 Bytes                     V
 #
-# Header structure:         [ 8 Bytes packet length | 1 Byte packet command | 1 Byte content type | 48 Bytes SHA384 checksum ]
+# Header structure:         [ 8 Bytes packet length | 1 Byte packet command | 1 Byte content type | n Bytes checksum ]
+#
+# The checksum algorithm is negotiated during the login: the client may append a line with the names of its supported
+# algorithms (comma separated, preferred first) to the login data. In that case the login acceptance contains the chosen
+# algorithm (TYPE_DATA) and all further headers use its checksum length n. Otherwise (and for the login itself) SHA384 is used (n = 48).
+#
+# A login with checksum negotiation additionally returns a signed resume token (acceptance data: [algorithm | token]).
+# A reconnecting client may send CMD_RESUME with [token | optional algorithms] instead of CMD_LOGIN, which skips the
+# credential check. Tokens expire after the configured lifetime, with a server restart or when revoked (CMD_REVOKE_TOKEN).
 # Check response structure: [ 1 Byte packet command | 1 Byte validity indicator ]
 #
 # Packet command structure: [ 1 Bit additional data indicator | 1 Bit response indicator | 6 Bits command type ]
@@ -49,8 +90,17 @@ CMD_GET_DIRECTORIES = 0x01
 CMD_UPLOAD_FILE = 0x02
 CMD_DOWNLOAD_FILE = 0x03
 CMD_DOWNLOAD_FOLDER = 0x04
+CMD_MOVE = 0x05  # Also used to rename files and folders
+CMD_COPY = 0x06
+CMD_GET_JOB = 0x07
+CMD_RESUME = 0x08  # Replaces CMD_LOGIN on reconnects (skips the credential check)
+CMD_REVOKE_TOKEN = 0x09  # Without data all tokens of the user are revoked, otherwise only the given token
+CMD_DOWNLOAD_RANGE = 0x0a  # Command data: [path | offset | length], the checksum in the header only covers the range
+CMD_GET_BLOCKS = 0x0b  # Command data: [path | optional block size], response data: JSON with the size and the block checksums
+CMD_SYNC = 0x0c  # Command data: JSON manifest of the client, response data: JSON diff, followed by the file streams (see below)
 
 CDT_UPLOAD_FILE = CMD_UPLOAD_FILE | (1 << 7)
+CDT_SYNC = CMD_SYNC | (1 << 7)
 
 # List of responses and related data
 RSP_LOGIN = CMD_LOGIN | (1 << 6)
@@ -58,8 +108,27 @@ RSP_GET_DIRECTORIES = CMD_GET_DIRECTORIES | (1 << 6)
 RSP_UPLOAD_FILE = CMD_UPLOAD_FILE | (1 << 6)
 RSP_DOWNLOAD_FILE = CMD_DOWNLOAD_FILE | (1 << 6)
 RSP_DOWNLOAD_FOLDER = CMD_DOWNLOAD_FOLDER | (1 << 6)
+RSP_MOVE = CMD_MOVE | (1 << 6)
+RSP_COPY = CMD_COPY | (1 << 6)
+RSP_GET_JOB = CMD_GET_JOB | (1 << 6)
+RSP_RESUME = CMD_RESUME | (1 << 6)
+RSP_REVOKE_TOKEN = CMD_REVOKE_TOKEN | (1 << 6)
+RSP_DOWNLOAD_RANGE = CMD_DOWNLOAD_RANGE | (1 << 6)
+RSP_GET_BLOCKS = CMD_GET_BLOCKS | (1 << 6)
+RSP_SYNC = CMD_SYNC | (1 << 6)
 
 RDT_UPLOAD_FILE = CMD_UPLOAD_FILE | (1 << 6) | (1 << 7)
+RDT_SYNC = CMD_SYNC | (1 << 6) | (1 << 7)
+
+# Folder sync (CMD_SYNC):
+# Manifest:     {"folder": path, "mode": "download" | "upload" | "both", "files": [[relative path, size, mtime, checksum or ""], ...]}
+# Diff:         {"download": [[relative path, size, mtime], ...], "upload": [relative path, ...], "extra": [relative path, ...]}
+# Files with equal size and mtime (seconds) or equal checksum (negotiated algorithm) are unchanged. In the mode "both" the newer file wins,
+# "extra" lists the files of the client, that don't exist on the server (mode "download" only).
+# If the diff contains uploads, the client sends all of them in one CDT_SYNC stream and receives the result as RDT_SYNC data
+# ({"stored": [...], "failed": [...]}). Afterwards the server sends all downloads in one RDT_SYNC stream (TYPE_FILE).
+# Streams consist of frames and have an empty header checksum, each frame is verified on its own (failed files are synced again):
+# Frame structure:          [ 8 Bytes data length | 8 Bytes mtime (ns) | 2 Bytes name length | name | data | n Bytes checksum of the data ]
 
 # List of content types
 TYPE_NONE = 0x00
@@ -68,82 +137,144 @@ TYPE_FILE = 0x02
 TYPE_FAILURE = 0x03
 TYPE_SUCCESS = 0x04
 
+# Checksum algorithms (name -> checksum length, hash object constructor)
+class RunningCrc:
+    # Wraps a CRC function to provide the update/digest interface of hashlib
+    def __init__(self, function):
+        self.function = function
+        self.value = 0
+
+    def update(self, data: bytes) -> None:
+        self.value = self.function(data, self.value)
+
+    def digest(self) -> bytes:
+        return struct.pack("!I", self.value)
+
+
+CHECKSUMS = {
+    "sha384": (48, hashlib.sha384),
+    "blake2b": (32, lambda: hashlib.blake2b(digest_size=32)),
+    "crc32": (4, lambda: RunningCrc(zlib.crc32)),
+}
+if xxhash:
+    CHECKSUMS["xxh3"] = (8, xxhash.xxh3_64)
+if crc32c:
+    CHECKSUMS["crc32c"] = (4, lambda: RunningCrc(crc32c.crc32c))
+scrub.ALGORITHMS.update({name: constructor for name, (length, constructor) in CHECKSUMS.items()})  # Checksums of uploads are kept
+
 # List of validity indicator states
 CHECK_INVALID = 0x00
 CHECK_VALID = 0x01
 
 
-def socket_server(host_ip: str, port: int, usernames: list[str], userdata: list[str], basepath: str) -> None:
+def socket_server(host_ip: str, port: int, usernames: list[str], userdata: list[str], basepath: str,
+                  ssl_context: ssl.SSLContext | None = None, checksums: list[str] | None = None, token_lifetime: int = 86400) -> None:
     s_receive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s_receive.bind((host_ip, port))
     s_receive.listen()
 
     while True:
         s_client_connection, address = s_receive.accept()
-        print(f"[SOCKET LOG] Client with address {address[0]}:{address[1]} connected")
-        threading.Thread(target=handle_connection, args=(s_client_connection, usernames, userdata, basepath), daemon=True).start()
+        access_log.log(source="socket", event="connected", address=f"{address[0]}:{address[1]}")
+        threading.Thread(target=handle_connection, args=(s_client_connection, usernames, userdata, basepath, ssl_context, checksums, token_lifetime),
+                         daemon=True).start()
 
 
-def handle_connection(connection: socket.socket, usernames: list[str], userdata: list[str], basepath: str):
+def handle_connection(connection: socket.socket, usernames: list[str], userdata: list[str], basepath: str,
+                      ssl_context: ssl.SSLContext | None = None, checksums: list[str] | None = None, token_lifetime: int = 86400):
+    user_name = None
+    packet_memory = contextlib.ExitStack()  # Reservation of the buffer pool for the large data packet of the current command
     try:
+        if ssl_context is not None:  # The handshake runs in the client thread so that a slow client can't block accept()
+            connection = ssl_context.wrap_socket(connection, server_side=True)
+
         assert RETRY_COUNT > 0  # Ensure that the retry count is a positive integer
         assert isinstance(RETRY_COUNT, int)
 
-        # Login phase (executed only once per session)
+        # Login phase (executed only once per session, either with credentials or with a resume token)
         for counter in range(RETRY_COUNT):  # Loop for receiving the login data
             packet_len, packet_cmd, packet_type, packet_checksum = receive_header(connection)
-            if packet_cmd != CMD_LOGIN or packet_type != TYPE_DATA or not (0 < packet_len <= BUFFER):
+            if packet_cmd not in [CMD_LOGIN, CMD_RESUME] or packet_type != TYPE_DATA or not (0 < packet_len <= LOGIN_LIMIT):
                 raise ValueError("No login data received")
             packet_content = recvall(connection, packet_len)
             if calc_hash(packet_content) == packet_checksum:
-                send_check_response(connection, CMD_LOGIN, CHECK_VALID)
+                send_check_response(connection, packet_cmd, CHECK_VALID)
                 break
             else:
-                send_check_response(connection, CMD_LOGIN, CHECK_INVALID)
+                send_check_response(connection, packet_cmd, CHECK_INVALID)
         if counter >= (RETRY_COUNT - 1):
             raise ValueError(f"Retry count ({RETRY_COUNT}) exceeded")
-        user_name, user_hash = packet_content.decode("utf-8").split(SEPARATOR)
-        name_position = -1
-        hash_position = -1
-        for i in range(len(usernames)):
-            if user_name == usernames[i]:
-                name_position = i
-        for j in range(len(userdata)):
-            if user_hash == userdata[j]:
-                hash_position = j
-        if name_position == hash_position >= 0:
+        login_cmd = packet_cmd
+        login_rsp = RSP_LOGIN if login_cmd == CMD_LOGIN else RSP_RESUME
+        if login_cmd == CMD_RESUME:  # Resume data: [token | optional checksum algorithms]
+            token, *client_checksums = packet_content.decode("utf-8").split(SEPARATOR)
+            user_name = verify_token(token, usernames)
+            login_successful = user_name is not None
+        else:  # Login data: [name | hashed credentials | optional checksum algorithms]
+            user_name, user_hash, *client_checksums = packet_content.decode("utf-8").split(SEPARATOR)
+            name_position = -1
+            hash_position = -1
+            for i in range(len(usernames)):
+                if user_name == usernames[i]:
+                    name_position = i
+            for j in range(len(userdata)):
+                if user_hash == userdata[j]:
+                    hash_position = j
+            login_successful = name_position == hash_position >= 0
+            token = issue_token(user_name, token_lifetime) if login_successful else None
+        algorithm = "sha384"
+        if client_checksums:  # Use the first algorithm of the client, that is enabled on the server
+            for name in client_checksums[0].split(","):
+                if name in CHECKSUMS and name in (checksums or ["sha384", "blake2b"]):
+                    algorithm = name
+                    break
+        empty_checksum = bytes(CHECKSUMS[algorithm][0])
+        if login_successful:
             for counter in range(RETRY_COUNT):  # Loop for sending the login acceptance
-                send_header(connection, 0, RSP_LOGIN, TYPE_SUCCESS, bytes(48))
-                if receive_check_response(connection, RSP_LOGIN):
+                if client_checksums or login_cmd == CMD_RESUME:  # Acceptance data: [checksum algorithm | resume token]
+                    response_content = f"{algorithm}{SEPARATOR}{token}".encode("utf-8")
+                    send_header(connection, len(response_content), login_rsp, TYPE_DATA, calc_hash(response_content))
+                    connection.sendall(response_content)
+                else:
+                    send_header(connection, 0, login_rsp, TYPE_SUCCESS, bytes(48))
+                if receive_check_response(connection, login_rsp):
                     break
             if counter >= (RETRY_COUNT - 1):
                 raise ValueError(f"Retry count ({RETRY_COUNT}) exceeded")
         else:
             for counter in range(RETRY_COUNT):  # Loop for sending the login rejection
-                send_header(connection, 0, RSP_LOGIN, TYPE_FAILURE, bytes(48))
-                if receive_check_response(connection, RSP_LOGIN):
+                send_header(connection, 0, login_rsp, TYPE_FAILURE, bytes(48))
+                if receive_check_response(connection, login_rsp):
                     break
-            raise ValueError("Invalid login credentials")
+            raise ValueError("Invalid login credentials" if login_cmd == CMD_LOGIN else "Invalid resume token")
 
         # Command phase (accepting commands in a loop that only breaks if the connection is closed or an error occurs)
         while True:
 
             pending_data = False
+            scrub.note_activity()  # The integrity scrub pauses while clients are active
+            command_start = time.monotonic()
             for counter in range(RETRY_COUNT):  # Loop for receiving commands
-                packet_len, packet_cmd, packet_type, packet_checksum = receive_header(connection)
+                packet_len, packet_cmd, packet_type, packet_checksum = receive_header(connection, len(empty_checksum))
                 if packet_type == TYPE_NONE and packet_len == 0:
                     packet_content = None
-                    if packet_cmd in [CMD_GET_DIRECTORIES]:
+                    if packet_cmd in [CMD_GET_DIRECTORIES, CMD_REVOKE_TOKEN]:
                         send_check_response(connection, packet_cmd, CHECK_VALID)
                         break
                     else:
                         raise ValueError(f"Invalid packet command ({packet_cmd})")
                 elif packet_type == TYPE_DATA and packet_len > 0:
-                    if packet_len > BUFFER:
-                        raise ValueError(f"Packet is no file, but larger than the maximum of {BUFFER // (2 ** 20)} MB")
+                    packet_limit = DATA_LIMIT if packet_cmd == CMD_SYNC else COMMAND_LIMIT
+                    if packet_len > packet_limit:
+                        raise ValueError(f"Packet is no file, but larger than the maximum of {packet_limit // (2 ** 10)} KB")
+                    packet_content = None
+                    packet_memory.close()  # Releases the reservation of a packet that is received again
+                    if packet_len > COMMAND_LIMIT:  # Large manifests are counted against the buffer pool, so that the memory stays bounded
+                        packet_memory.enter_context(buffer_pool.reserve(packet_len))
                     packet_content = recvall(connection, packet_len)
-                    if packet_cmd in [CMD_UPLOAD_FILE, CMD_DOWNLOAD_FILE, CMD_DOWNLOAD_FOLDER]:
-                        if calc_hash(packet_content) == packet_checksum:
+                    if packet_cmd in [CMD_UPLOAD_FILE, CMD_DOWNLOAD_FILE, CMD_DOWNLOAD_FOLDER, CMD_MOVE, CMD_COPY, CMD_GET_JOB, CMD_REVOKE_TOKEN,
+                                      CMD_DOWNLOAD_RANGE, CMD_GET_BLOCKS, CMD_SYNC]:
+                        if calc_hash(packet_content, algorithm) == packet_checksum:
                             send_check_response(connection, packet_cmd, CHECK_VALID)
                             break
                         else:
@@ -157,18 +288,23 @@ def handle_connection(connection: socket.socket, usernames: list[str], userdata:
                 raise ValueError(f"Retry count ({RETRY_COUNT}) exceeded")
 
             # Process the received data and create responses
-            response_len, response_cmd, response_type, response_checksum = 0, 0, 0, bytes(48)
+            command, transferred = packet_cmd, packet_len
+            response_len, response_cmd, response_type, response_checksum = 0, 0, 0, empty_checksum
             response_content, file_name, file_path = None, None, None
+            file_offset = 0
+            sync_plan = None
 
             if packet_cmd == CMD_GET_DIRECTORIES:
                 response_cmd = RSP_GET_DIRECTORIES
                 response_type = TYPE_DATA
                 folders = list()
                 for root, dirs, files in os.walk(os.path.join(basepath, "users", user_name)):
+                    if root == os.path.join(basepath, "users", user_name) and file_operations.TRASH_DIR in dirs:
+                        dirs.remove(file_operations.TRASH_DIR)
                     folders.append(root.replace(os.path.join(basepath, "users") + "/", ""))
                 response_content = ("\n".join(folders)).encode("utf-8")
                 response_len = len(response_content)
-                response_checksum = calc_hash(response_content)
+                response_checksum = calc_hash(response_content, algorithm)
 
             elif packet_cmd == CMD_UPLOAD_FILE:
                 response_cmd = RSP_UPLOAD_FILE
@@ -191,12 +327,13 @@ def handle_connection(connection: socket.socket, usernames: list[str], userdata:
                 else:
                     response_len = os.path.getsize(file_name)
                     response_type = TYPE_FILE
-                    response_checksum = calc_hash(file_name)
+                    response_checksum = calc_hash(file_name, algorithm)
 
             elif packet_cmd == CMD_DOWNLOAD_FOLDER:
                 response_cmd = RSP_DOWNLOAD_FOLDER
-                dir_path = os.path.join(basepath, "users", packet_content.decode("utf-8"))
-                if not packet_content.decode("utf-8").startswith(user_name) or not os.path.isdir(dir_path):
+                folder = packet_content.decode("utf-8").rstrip("/")
+                dir_path = os.path.join(basepath, "users", folder)
+                if not owns_path(folder, user_name) or not os.path.isdir(dir_path):
                     response_type = TYPE_FAILURE
                 else:
                     if os.path.basename(dir_path):
@@ -208,53 +345,151 @@ def handle_connection(connection: socket.socket, usernames: list[str], userdata:
                         raise ValueError(f"Invalid file name (contains {SEPARATOR})")
                     if os.path.isfile(file_name):
                         os.remove(file_name)
-                    shutil.make_archive(file_name[:-4], "zip", dir_path)
+                    archive.make_zip(file_name, dir_path, folder == user_name)
                     response_len = os.path.getsize(file_name)
                     response_type = TYPE_FILE
-                    response_checksum = calc_hash(file_name)
+                    response_checksum = calc_hash(file_name, algorithm)
+
+            elif packet_cmd in [CMD_MOVE, CMD_COPY]:  # Command data: [source path \n target path] (target includes the new name)
+                response_cmd = RSP_MOVE if packet_cmd == CMD_MOVE else RSP_COPY
+                source_path, target_path = packet_content.decode("utf-8").split(SEPARATOR)
+                source_name = os.path.join(basepath, "users", source_path)
+                target_name = os.path.join(basepath, "users", target_path)
+                if not owns_path(source_path, user_name) or not owns_path(target_path, user_name) or len(source_path.split("/")) < 2 \
+                        or not os.path.exists(source_name) or os.path.lexists(target_name) \
+                        or not os.path.isdir(os.path.dirname(target_name)) or (target_name + "/").startswith(source_name + "/"):
+                    response_type = TYPE_FAILURE
+                elif packet_cmd == CMD_MOVE:
+                    file_operations.move_entry(source_name, target_name)
+                    response_type = TYPE_SUCCESS
+                elif os.path.isdir(source_name):  # Folders are copied in the background, the response contains the job id
+                    response_content = file_operations.start_copy_job(source_name, target_name, user_name).encode("utf-8")
+                    response_type = TYPE_DATA
+                    response_len = len(response_content)
+                    response_checksum = calc_hash(response_content, algorithm)
+                else:
+                    file_operations.copy_file(source_name, target_name)
+                    response_type = TYPE_SUCCESS
+
+            elif packet_cmd == CMD_GET_JOB:
+                response_cmd = RSP_GET_JOB
+                job = file_operations.get_job(packet_content.decode("utf-8"), user_name)
+                if job is None:
+                    response_type = TYPE_FAILURE
+                else:
+                    response_content = json.dumps(job).encode("utf-8")
+                    response_type = TYPE_DATA
+                    response_len = len(response_content)
+                    response_checksum = calc_hash(response_content, algorithm)
+
+            elif packet_cmd == CMD_REVOKE_TOKEN:
+                response_cmd = RSP_REVOKE_TOKEN
+                if packet_content is None:
+                    REVOKED_BEFORE[user_name] = time.time()
+                    response_type = TYPE_SUCCESS
+                else:
+                    response_type = TYPE_SUCCESS if revoke_token(packet_content.decode("utf-8"), user_name) else TYPE_FAILURE
+
+            elif packet_cmd == CMD_DOWNLOAD_RANGE:  # Allows parallel downloads over several connections and retries of single ranges
+                response_cmd = RSP_DOWNLOAD_RANGE
+                path, offset, length = packet_content.decode("utf-8").split(SEPARATOR)
+                file_name = os.path.join(basepath, "users", path)
+                file_offset, length = int(offset), int(length)
+                if not owns_path(path, user_name) or not os.path.isfile(file_name) or file_offset < 0 or length <= 0 \
+                        or file_offset >= os.path.getsize(file_name):
+                    response_type = TYPE_FAILURE
+                else:
+                    response_len = min(length, os.path.getsize(file_name) - file_offset)
+                    response_type = TYPE_FILE
+                    response_checksum = calc_block_hashes(file_name, algorithm, file_offset, response_len, response_len)[0]
+
+            elif packet_cmd == CMD_GET_BLOCKS:
+                response_cmd = RSP_GET_BLOCKS
+                path, *block_size = packet_content.decode("utf-8").split(SEPARATOR)
+                file_name = os.path.join(basepath, "users", path)
+                block_size = int(block_size[0]) if block_size else BLOCK_SIZE
+                if not owns_path(path, user_name) or not os.path.isfile(file_name) or not (MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE):
+                    response_type = TYPE_FAILURE
+                else:
+                    file_size = os.path.getsize(file_name)
+                    blocks = calc_block_hashes(file_name, algorithm, 0, file_size, block_size)
+                    response_content = json.dumps({"size": file_size, "block_size": block_size, "algorithm": algorithm,
+                                                   "blocks": [block.hex() for block in blocks]}).encode("utf-8")
+                    response_type = TYPE_DATA
+                    response_len = len(response_content)
+                    response_checksum = calc_hash(response_content, algorithm)
+
+            elif packet_cmd == CMD_SYNC:
+                response_cmd = RSP_SYNC
+                manifest = json.loads(packet_content)
+                if not owns_path(manifest["folder"], user_name) or not os.path.isdir(os.path.join(basepath, "users", manifest["folder"])) \
+                        or manifest["mode"] not in ["download", "upload", "both"]:
+                    response_type = TYPE_FAILURE
+                else:
+                    sync_plan = plan_sync(basepath, user_name, manifest, algorithm)
+                    response_content = json.dumps(sync_plan).encode("utf-8")
+                    response_type = TYPE_DATA
+                    response_len = len(response_content)
+                    response_checksum = calc_hash(response_content, algorithm)
 
             else:
                 raise Exception("Invalid command to process. Command changed after receipt.")
 
+            # The command data is released before the response is counted, holding both could deadlock with other connections
+            packet_content = None
+            packet_memory.close()
+            if response_type == TYPE_DATA and response_len > DATA_LIMIT:
+                raise ValueError("Packet size overflow")
+            if response_type == TYPE_DATA and response_len > COMMAND_LIMIT:
+                packet_memory.enter_context(buffer_pool.reserve(response_len))
             for counter in range(RETRY_COUNT):  # Loop for sending responses
                 send_header(connection, response_len, response_cmd, response_type, response_checksum)
                 if response_len > 0:
                     if response_type == TYPE_DATA:
-                        if response_len > BUFFER:
-                            raise ValueError("Packet size overflow")
                         connection.sendall(response_content)
                     elif response_type == TYPE_FILE:
-                        with open(file_name, "rb") as file_to_send:
-                            while True:
-                                raw_data = file_to_send.read(BUFFER)
-                                if not raw_data:
-                                    break
-                                connection.sendall(raw_data)
+                        with open(file_name, "rb") as file_to_send, buffer_pool.buffer() as file_buffer:
+                            file_to_send.seek(file_offset)
+                            remaining = response_len  # Exactly the announced length is sent, even if the file grew meanwhile
+                            while remaining:
+                                buffer_len = file_to_send.readinto(file_buffer[:min(len(file_buffer), remaining)])
+                                if not buffer_len:
+                                    raise Exception(f"File shrunk during the transfer ({file_name})")
+                                connection.sendall(file_buffer[:buffer_len])
+                                remaining -= buffer_len
                     else:
                         raise Exception("Invalid response type defined")
                 if receive_check_response(connection, response_cmd):
                     break
             if counter >= (RETRY_COUNT - 1):
                 raise ValueError(f"Retry count ({RETRY_COUNT}) exceeded")
+            transferred += response_len
+            response_content = None
+            packet_memory.close()
+
+            if sync_plan:
+                transferred += sync_streams(connection, basepath, user_name, manifest["folder"], sync_plan, algorithm, empty_checksum)
 
             if pending_data:
                 for counter in range(RETRY_COUNT):  # Loop for receiving additional data
-                    packet_len, packet_cmd, packet_type, packet_checksum = receive_header(connection)
+                    packet_len, packet_cmd, packet_type, packet_checksum = receive_header(connection, len(empty_checksum))
                     if packet_type == TYPE_FILE and packet_len > 0:
                         if packet_cmd in [CDT_UPLOAD_FILE]:
-                            current_len = 0
-                            with open(file_name, "wb") as new_file:
-                                while current_len < packet_len:
-                                    file_buffer = connection.recv(min(BUFFER, packet_len - current_len))
-                                    if not file_buffer:
-                                        raise Exception(f"File transfer interrupted (broken file: {file_name})")
-                                    new_file.write(file_buffer)
-                                    current_len += len(file_buffer)
-                            if calc_hash(file_name) == packet_checksum:
+                            # The file only appears under its name after it was received completely and verified
+                            hash_object = CHECKSUMS[algorithm][1]()
+                            staged_file = upload_writer.StagedFile(file_name, os.path.join(basepath, "users", user_name), packet_len, hash_object, algorithm)
+                            try:
+                                upload_writer.write_stream(staged_file, connection.recv_into, packet_len, hash_object)
+                            except Exception:
+                                staged_file.discard()
+                                raise
+                            if hash_object.digest() == packet_checksum:
+                                staged_file.commit()
+                                file_cache.invalidate(file_name)
                                 send_check_response(connection, packet_cmd, CHECK_VALID)
                                 break
                             else:
-                                os.remove(file_name)
+                                staged_file.discard()
                                 send_check_response(connection, packet_cmd, CHECK_INVALID)
                                 continue
                         else:
@@ -265,7 +500,7 @@ def handle_connection(connection: socket.socket, usernames: list[str], userdata:
                     raise ValueError(f"Retry count ({RETRY_COUNT}) exceeded")
 
                 # Process the received data and create responses
-                response_len, response_cmd, response_type, response_checksum = 0, 0, 0, bytes(48)
+                response_len, response_cmd, response_type, response_checksum = 0, 0, 0, empty_checksum
 
                 if packet_cmd == CDT_UPLOAD_FILE:
                     response_cmd = RDT_UPLOAD_FILE
@@ -280,22 +515,69 @@ def handle_connection(connection: socket.socket, usernames: list[str], userdata:
                         break
                 if counter >= (RETRY_COUNT - 1):
                     raise ValueError(f"Retry count ({RETRY_COUNT}) exceeded")
+                transferred += packet_len
+
+            access_log.log(source="socket", user=user_name, command=command, bytes=transferred,
+                           duration=round(time.monotonic() - command_start, 4), status=response_type)
 
-    except ConnectionError as e:
-        print(f"[SOCKET LOG] Error: {e}")
+    except (ConnectionError, ssl.SSLError) as e:
+        access_log.log("warning", source="socket", user=user_name, event="connection error", error=str(e))
         connection.close()
     except ValueError as e:
-        print(f"[SOCKET LOG] Connection closed for security reasons: {e}")
+        access_log.log("warning", source="socket", user=user_name, event="closed for security reasons", error=str(e))
         connection.close()
     except Exception as e:
-        print(f"[SOCKET LOG] Fatal Error: {e}")
+        access_log.log("error", source="socket", user=user_name, event="fatal error", error=str(e))
         connection.close()
+    finally:
+        packet_memory.close()
+
+
+def issue_token(user_name: str, lifetime: int) -> str:
+    issued = time.time()
+    payload = f"{user_name}:{issued:.6f}:{issued + lifetime:.0f}:{secrets.token_hex(8)}"
+    return payload + ":" + hmac.new(TOKEN_SECRET, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def parse_token(token: str) -> tuple[str, float, float, str] | None:
+    payload, _, signature = token.rpartition(":")
+    # Compared as bytes: compare_digest raises a TypeError for strings with non-ASCII characters
+    if not hmac.compare_digest(hmac.new(TOKEN_SECRET, payload.encode("utf-8"), hashlib.sha256).hexdigest().encode("ascii"), signature.encode("utf-8")):
+        return None
+    user_name, issued, expires, token_id = payload.rsplit(":", 3)
+    return user_name, float(issued), float(expires), token_id
+
+
+def verify_token(token: str, usernames: list[str]) -> str | None:
+    fields = parse_token(token)
+    if fields is None:
+        return None
+    user_name, issued, expires, token_id = fields
+    if expires < time.time() or token_id in REVOKED_TOKENS or issued <= REVOKED_BEFORE.get(user_name, 0) or user_name not in usernames:
+        return None
+    return user_name
+
+
+def revoke_token(token: str, user_name: str) -> bool:
+    fields = parse_token(token)
+    if fields is None or fields[0] != user_name:
+        return False
+    for token_id in [token_id for token_id, expires in REVOKED_TOKENS.items() if expires < time.time()]:
+        del REVOKED_TOKENS[token_id]  # Expired tokens are rejected anyway
+    REVOKED_TOKENS[fields[3]] = fields[2]
+    return True
+
+
+def owns_path(path: str, user_name: str) -> bool:
+    parts = path.split("/")
+    return parts[0] == user_name and all(part not in ["", ".", ".."] for part in parts) and SEPARATOR not in path \
+        and parts[1:2] != [file_operations.TRASH_DIR]
 
 
 def recvall(sock: socket.socket, data_len: int) -> bytes:
     data = bytearray()
     while len(data) < data_len:
-        packet = sock.recv(min(BUFFER, data_len - len(data)))
+        packet = sock.recv(min(buffer_pool.BUFFER_SIZE, data_len - len(data)))  # Grows with the received data only
         if not packet:
             raise ConnectionError("Connection closed during transfer")
         data.extend(packet)
@@ -303,12 +585,11 @@ def recvall(sock: socket.socket, data_len: int) -> bytes:
 
 
 def send_header(sock: socket.socket, msg_len: int, msg_cmd: int, msg_type: int, msg_checksum: bytes) -> None:
-    assert len(msg_checksum) == 48  # SHA384 hash length
     sock.sendall(struct.pack("!Q", msg_len) + struct.pack("!B", msg_cmd) + struct.pack("!B", msg_type) + msg_checksum)
 
 
-def receive_header(sock: socket.socket) -> tuple[int, int, int, bytes]:
-    raw_header = recvall(sock, 58)
+def receive_header(sock: socket.socket, checksum_len: int = 48) -> tuple[int, int, int, bytes]:
+    raw_header = recvall(sock, 10 + checksum_len)
     return struct.unpack("!Q", raw_header[:8])[0], raw_header[8], raw_header[9], raw_header[10:]
 
 
@@ -323,20 +604,172 @@ def receive_check_response(sock: socket.socket, msg_cmd: int) -> bool:
     return True if raw_response[1] == CHECK_VALID else False
 
 
-def calc_hash(obj) -> bytes:
-    hash_object = hashlib.sha384()
+def calc_hash(obj, algorithm: str = "sha384") -> bytes:
+    hash_object = CHECKSUMS[algorithm][1]()
     if isinstance(obj, bytes):
         hash_object.update(obj)
         return hash_object.digest()
     elif isinstance(obj, str):
         if not os.path.isfile(obj):
             raise ValueError("The file to be hashed does not exist")
-        with open(obj, "rb") as f:
+        with open(obj, "rb") as f, buffer_pool.buffer() as file_buffer:
             while True:
-                data = f.read(BUFFER)
-                if not data:
+                buffer_len = f.readinto(file_buffer)
+                if not buffer_len:
                     break
-                hash_object.update(data)
+                hash_object.update(file_buffer[:buffer_len])
         return hash_object.digest()
     else:
         raise Exception("The object to be hashed must be of type bytes or a path string")
+
+
+def plan_sync(basepath: str, user_name: str, manifest: dict, algorithm: str) -> dict:
+    directory = os.path.join(basepath, "users", manifest["folder"])
+    server_files = dict()  # relative path -> (size, mtime)
+    for root, dirs, files in os.walk(directory):
+        if root == os.path.join(basepath, "users", user_name) and file_operations.TRASH_DIR in dirs:
+            dirs.remove(file_operations.TRASH_DIR)
+        for file in files:
+            stats = os.stat(os.path.join(root, file))
+            server_files[os.path.relpath(os.path.join(root, file), directory)] = (stats.st_size, stats.st_mtime_ns)
+    client_files = dict()
+    for path, size, mtime, checksum in manifest["files"]:
+        if not owns_path(f"{manifest['folder']}/{path}", user_name):
+            raise ValueError(f"Invalid path in the sync manifest ({path})")
+        client_files[path] = (int(size), int(mtime), checksum)
+    download, upload = list(), list()
+    for path, (size, mtime_ns) in sorted(server_files.items()):
+        if path not in client_files:
+            if manifest["mode"] != "upload":
+                download.append([path, size, mtime_ns])
+            continue
+        client_size, client_mtime, client_checksum = client_files[path]
+        if size == client_size and (mtime_ns // 10**9 == client_mtime or
+                                    (client_checksum and calc_hash(os.path.join(directory, path), algorithm).hex() == client_checksum)):
+            continue  # The checksum is only calculated, if size and mtime are not sufficient
+        if manifest["mode"] == "download" or (manifest["mode"] == "both" and mtime_ns // 10**9 > client_mtime):
+            download.append([path, size, mtime_ns])
+        else:
+            upload.append(path)
+    missing = sorted(path for path in client_files if path not in server_files)
+    if manifest["mode"] != "download":
+        upload.extend(missing)
+    return {"download": download, "upload": upload, "extra": missing if manifest["mode"] == "download" else []}
+
+
+def sync_streams(connection: socket.socket, basepath: str, user_name: str, folder: str, plan: dict, algorithm: str, empty_checksum: bytes) -> int:
+    # Transfers all files of the sync plan: the uploads of the client first, then the downloads
+    directory = os.path.join(basepath, "users", folder)
+    checksum_len = len(empty_checksum)
+    transferred = 0
+    if plan["upload"]:
+        packet_len, packet_cmd, packet_type, packet_checksum = receive_header(connection, checksum_len)
+        if packet_cmd != CDT_SYNC or packet_type != TYPE_FILE:
+            raise ValueError(f"Invalid sync stream ({packet_cmd}, {packet_type})")
+        result = {"stored": list(), "failed": list()}
+        requested = set(plan["upload"])
+        received = 0
+        while received < packet_len:
+            size, mtime_ns, name_len = struct.unpack("!QQH", recvall(connection, 18))
+            path = recvall(connection, name_len).decode("utf-8")
+            received += 18 + name_len + size + checksum_len
+            if received > packet_len or path not in requested:
+                raise ValueError(f"Invalid frame in the sync stream ({path})")
+            requested.discard(path)
+            target = os.path.join(directory, path)
+            hash_object = CHECKSUMS[algorithm][1]()
+            try:  # The old version stays in place until the new one is complete
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                staged_file = upload_writer.StagedFile(target, os.path.join(basepath, "users", user_name), size, hash_object, algorithm)
+            except OSError:
+                staged_file = None  # The data is received anyway to keep the stream in sync
+            try:
+                upload_writer.write_stream(staged_file, connection.recv_into, size, hash_object)
+            except Exception:
+                if staged_file:
+                    staged_file.discard()
+                raise
+            valid = hash_object.digest() == recvall(connection, checksum_len)
+            try:
+                if not valid or not staged_file or os.path.isdir(target):
+                    raise OSError("Invalid checksum or target")
+                if os.path.lexists(target):  # Replaced files can be restored from the trash
+                    file_operations.move_to_trash(target, os.path.join(basepath, "users", user_name, file_operations.TRASH_DIR), f"{folder}/{path}")
+                staged_file.commit(overwrite=True, mtime_ns=mtime_ns)
+                file_cache.invalidate(target)
+                result["stored"].append(path)
+            except OSError:
+                if staged_file:
+                    staged_file.discard()
+                result["failed"].append(path)
+        send_check_response(connection, CDT_SYNC, CHECK_VALID)  # The frames were verified individually
+        result["failed"].extend(sorted(requested))  # Requested, but not sent by the client
+        transferred += packet_len
+        response_content = json.dumps(result).encode("utf-8")
+        for counter in range(RETRY_COUNT):
+            send_header(connection, len(response_content), RDT_SYNC, TYPE_DATA, calc_hash(response_content, algorithm))
+            connection.sendall(response_content)
+            if receive_check_response(connection, RDT_SYNC):
+                break
+        if counter >= (RETRY_COUNT - 1):
+            raise ValueError(f"Retry count ({RETRY_COUNT}) exceeded")
+    if plan["download"]:
+        stream_len = sum(18 + len(path.encode("utf-8")) + size + checksum_len for path, size, mtime_ns in plan["download"])
+        send_header(connection, stream_len, RDT_SYNC, TYPE_FILE, empty_checksum)
+        with buffer_pool.buffer() as file_buffer:
+            for path, size, mtime_ns in plan["download"]:
+                encoded_path = path.encode("utf-8")
+                connection.sendall(struct.pack("!QQH", size, mtime_ns, len(encoded_path)) + encoded_path)
+                hash_object = CHECKSUMS[algorithm][1]()
+                with open(os.path.join(directory, path), "rb") as file_to_send:
+                    remaining = size
+                    while remaining:
+                        buffer_len = file_to_send.readinto(file_buffer[:min(len(file_buffer), remaining)])
+                        if not buffer_len:
+                            raise Exception(f"File shrunk during the transfer ({path})")
+                        hash_object.update(file_buffer[:buffer_len])
+                        connection.sendall(file_buffer[:buffer_len])
+                        remaining -= buffer_len
+                connection.sendall(hash_object.digest())
+        receive_check_response(connection, RDT_SYNC)  # Files with invalid checksums are requested again by the next sync
+        transferred += stream_len
+    return transferred
+
+
+def calc_block_hashes(file_name: str, algorithm: str, offset: int, length: int, block_size: int) -> list[bytes]:
+    # Hashes the given range of the file in blocks (the last block may be shorter) with a single read pass
+    hashes = list()
+    hash_object = CHECKSUMS[algorithm][1]()
+    block_left = block_size
+    with open(file_name, "rb") as f, buffer_pool.buffer() as file_buffer:
+        f.seek(offset)
+        while length:
+            buffer_len = f.readinto(file_buffer[:min(len(file_buffer), length, block_left)])
+            if not buffer_len:
+                raise Exception(f"File shrunk while hashing ({file_name})")
+            hash_object.update(file_buffer[:buffer_len])
+            length -= buffer_len
+            block_left -= buffer_len
+            if not block_left or not length:
+                hashes.append(hash_object.digest())
+                hash_object = CHECKSUMS[algorithm][1]()
+                block_left = block_size
+    return hashes
+
+
+def benchmark_checksums() -> dict[str, float]:
+    data = os.urandom(2**20)
+    results = dict()
+    for name, (length, constructor) in CHECKSUMS.items():
+        hash_object = constructor()
+        start = time.perf_counter()
+        for i in range(BENCHMARK_SIZE // len(data)):
+            hash_object.update(data)
+        hash_object.digest()
+        results[name] = BENCHMARK_SIZE / 2**20 / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == "__main__":  # Checksum benchmark of the running host: python3 socket_interface.py
+    for name, speed in benchmark_checksums().items():
+        print(f"{name:<8} {speed:10.1f} MB/s")
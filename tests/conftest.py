@@ -0,0 +1,8 @@
+# Shared setup of the tests: the gevent monkey patching happens first, as in server.py
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
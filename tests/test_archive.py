@@ -0,0 +1,80 @@
+import io
+import os
+import time
+import gevent
+import pytest
+import tarfile
+import zipfile
+import archive
+import file_operations
+
+
+def unpack(source, target):
+    job_id = archive.start_unpack_job(str(source), str(target), "guest", "guest/out")
+    deadline = time.monotonic() + 10
+    while file_operations.JOBS[job_id]["status"] == "running" and time.monotonic() < deadline:
+        gevent.sleep(0.05)
+    return file_operations.JOBS[job_id]
+
+
+def test_zip_stream_is_valid(tmp_path):
+    (tmp_path / "folder").mkdir()
+    (tmp_path / "folder" / "text.txt").write_text("compressible " * 1000)
+    (tmp_path / "photo.jpg").write_bytes(os.urandom(5000))
+    target = tmp_path / "out.zip"
+    with open(target, "wb") as out:
+        for chunk in archive.zip_stream(archive.directory_entries(str(tmp_path / "folder"), "folder") + [(str(tmp_path / "photo.jpg"), "photo.jpg")], str(tmp_path)):
+            out.write(chunk)
+    with zipfile.ZipFile(target) as result:
+        assert result.testzip() is None
+        assert result.read("folder/text.txt") == b"compressible " * 1000
+        assert result.getinfo("folder/text.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert result.getinfo("photo.jpg").compress_type == zipfile.ZIP_STORED  # Media files are never deflated
+
+
+def test_directory_entries_skip_the_trash(tmp_path):
+    (tmp_path / file_operations.TRASH_DIR / ".staging").mkdir(parents=True)
+    (tmp_path / file_operations.TRASH_DIR / ".staging" / "partial").write_text("x")
+    (tmp_path / "sub" / file_operations.TRASH_DIR).mkdir(parents=True)  # Only the trash of the user folder is special
+    names = [name for path, name in archive.directory_entries(str(tmp_path), skip_trash=True)]
+    assert names == ["sub/", "sub/.trash/"]
+
+
+def test_member_path():
+    assert archive.member_path("/target", "/etc/passwd") == "/target/etc/passwd"
+    assert archive.member_path("/target", "a/../../b") is None
+    assert archive.member_path("/target", "./") is None
+
+
+def test_check_limits(monkeypatch):
+    monkeypatch.setattr(archive, "MAX_ENTRIES", 10)
+    monkeypatch.setattr(archive, "MAX_BYTES", 1000)
+    monkeypatch.setattr(archive, "MAX_RATIO", 5)
+    archive.check_limits(10, 500, 100)
+    for entries, size, archive_size in [(11, 0, 100), (1, 1001, 1000), (1, 501, 100)]:
+        with pytest.raises(ValueError):
+            archive.check_limits(entries, size, archive_size)
+
+
+def test_unpack_rejects_bomb(tmp_path):
+    with zipfile.ZipFile(tmp_path / "bomb.zip", "w", zipfile.ZIP_DEFLATED) as bomb:
+        bomb.writestr("zeros", bytes(2**24))
+    job = unpack(tmp_path / "bomb.zip", tmp_path / "out")
+    assert job["status"] == "failed" and "expands" in job["error"]
+    assert not (tmp_path / "out").exists()  # Nothing is left behind
+
+
+def test_unpack_duplicate_names(tmp_path):
+    with pytest.warns(UserWarning):  # zipfile warns about duplicate names, but writes them
+        with zipfile.ZipFile(tmp_path / "dup.zip", "w") as duplicate:
+            duplicate.writestr("file.txt", "first")
+            duplicate.writestr("file.txt", "second")
+    with tarfile.open(tmp_path / "dup.tar", "w") as duplicate:
+        for data in [b"first", b"second"]:
+            info = tarfile.TarInfo("file.txt")
+            info.size = len(data)
+            duplicate.addfile(info, io.BytesIO(data))
+    for name in ["dup.zip", "dup.tar"]:
+        job = unpack(tmp_path / name, tmp_path / f"out-{name}")
+        assert job["status"] == "done", job["error"]
+        assert (tmp_path / f"out-{name}" / "file.txt").read_text() == "second"  # The later member wins
@@ -0,0 +1,39 @@
+import gevent
+import buffer_pool
+
+
+def test_buffers_stay_within_budget():
+    pool = buffer_pool.BufferPool(4 * 1024, buffer_size=1024)
+
+    def transfer():
+        with pool.buffers(2) as views:
+            assert all(len(view) == 1024 for view in views)
+            gevent.sleep(0.01)
+
+    assert len(gevent.joinall([gevent.spawn(transfer) for i in range(10)], timeout=5, raise_error=True)) == 10
+    stats = pool.stats()
+    assert stats["peak"] <= 4 and stats["allocated"] <= 4
+    assert stats["in_use"] == 0 and stats["waits"] > 0
+
+
+def test_reservation_releases_free_buffers():
+    pool = buffer_pool.BufferPool(4 * 1024, buffer_size=1024)
+    with pool.buffers(4):
+        pass
+    assert pool.stats()["allocated"] == 4
+    with pool.reserve(2500):  # Three buffers, their memory is released for the data held outside the pool
+        assert pool.stats()["allocated"] == 4 and len(pool.free) == 1 and pool.stats()["reserved"] == 3
+    assert pool.stats()["allocated"] == 1 and pool.stats()["reserved"] == 0
+
+
+def test_reservation_leaves_one_buffer():
+    pool = buffer_pool.BufferPool(4 * 1024, buffer_size=1024)
+
+    def command():
+        with pool.reserve(10**6):  # Capped at all buffers but one
+            gevent.sleep(0.01)
+            with pool.buffer():  # e.g. hashing a file while holding the manifest
+                gevent.sleep(0.01)
+
+    assert len(gevent.joinall([gevent.spawn(command) for i in range(5)], timeout=5, raise_error=True)) == 5  # No deadlock
+    assert pool.stats()["in_use"] == 0 and pool.stats()["reserved"] == 0
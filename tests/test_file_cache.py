@@ -0,0 +1,30 @@
+import file_cache
+from gevent.threadpool import ThreadPool
+
+
+def test_get_and_invalidate(tmp_path):
+    cache = file_cache.FileCache(2**20, 2**10)
+    (tmp_path / "file").write_text("data")
+    data, etag, mtime = cache.get(str(tmp_path / "file"))
+    assert data == b"data" and cache.get(str(tmp_path / "file"))[1] == etag
+    cache.invalidate(str(tmp_path))
+    assert cache.stats()["files"] == 0 and cache.stats()["used"] == 0
+
+
+def test_invalidate_from_native_threads(tmp_path):
+    cache = file_cache.FileCache(2**20, 2**10)
+    for i in range(50):
+        (tmp_path / f"file{i}").write_text(str(i))
+
+    def invalidate(offset):
+        for i in range(500):
+            cache.invalidate(str(tmp_path / f"file{(offset + i) % 50}"))
+
+    pool = ThreadPool(4)
+    tasks = [pool.spawn(invalidate, offset) for offset in range(8)]
+    for i in range(10):
+        for number in range(50):
+            cache.get(str(tmp_path / f"file{number}"))
+    for task in tasks:
+        task.get()  # Raises if a thread failed
+    assert cache.used == sum(len(entry[1]) for entry in cache.entries.values())
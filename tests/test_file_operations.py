@@ -0,0 +1,62 @@
+import os
+import json
+import pytest
+import file_operations
+
+
+@pytest.fixture
+def user(tmp_path):
+    root = tmp_path / "guest"
+    (root / "folder").mkdir(parents=True)
+    (root / "folder" / "file.txt").write_text("data")
+    return root
+
+
+def test_trash_round_trip(user):
+    trash = str(user / file_operations.TRASH_DIR)
+    entry_id = file_operations.move_to_trash(str(user / "folder"), trash, "guest/folder")
+    assert not (user / "folder").exists()
+    assert [entry["id"] for entry in file_operations.list_trash(trash)] == [entry_id]
+    file_operations.restore_from_trash(trash, entry_id, str(user / "folder"))
+    assert (user / "folder" / "file.txt").read_text() == "data"
+    assert os.listdir(trash) == []
+
+
+def test_failed_move_leaves_no_entry(user):
+    trash = str(user / file_operations.TRASH_DIR)
+    with pytest.raises(FileNotFoundError):
+        file_operations.move_to_trash(str(user / "missing"), trash, "guest/missing")
+    assert os.listdir(trash) == []
+
+
+def test_purge_removes_expired_and_damaged_entries(user):
+    trash = user / file_operations.TRASH_DIR
+    file_operations.move_to_trash(str(user / "folder"), str(trash), "guest/folder")
+    (trash / "1-orphan").mkdir()  # Folder without metadata
+    (trash / "2-damaged").mkdir()
+    (trash / "2-damaged.json").write_text('{"orig')  # Truncated metadata
+    (trash / ".staging").mkdir()  # Unfinished uploads are not part of the trash
+    assert len(file_operations.list_trash(str(trash))) == 1
+    file_operations.purge_trash(str(trash), 3600, 2**30)
+    assert len(os.listdir(trash)) == 6  # Nothing expired yet
+    file_operations.purge_trash(str(trash), 0, 2**30)
+    assert os.listdir(trash) == [".staging"]
+
+
+def test_purge_continues_after_failed_entry(user, monkeypatch):
+    trash = user / file_operations.TRASH_DIR
+    (user / "other").write_text("x")
+    file_operations.move_to_trash(str(user / "folder"), str(trash), "guest/folder")
+    file_operations.move_to_trash(str(user / "other"), str(trash), "guest/other")
+    rmdir, calls = os.rmdir, []
+
+    def racing_rmdir(path):
+        calls.append(path)
+        if len(calls) == 1:
+            raise FileNotFoundError(2, "Restored meanwhile", path)
+        rmdir(path)
+
+    monkeypatch.setattr(os, "rmdir", racing_rmdir)
+    file_operations.purge_trash(str(trash), 0, 2**30)
+    assert len(os.listdir(trash)) == 2  # Only the failed entry is left (folder and metadata)
+    assert json.loads((trash / [name for name in os.listdir(trash) if name.endswith(".json")][0]).read_text())["origin"]
@@ -0,0 +1,60 @@
+import os
+import pytest
+import scrub
+import socket_interface  # Registers the negotiable checksums
+
+
+@pytest.fixture
+def scrubber(tmp_path, monkeypatch):
+    (tmp_path / "users" / "guest").mkdir(parents=True)
+    monkeypatch.setattr(scrub, "recording", True)
+    monkeypatch.setattr(scrub, "written", dict())
+    checker = scrub.Scrubber(str(tmp_path / "scrub.db"), str(tmp_path) + "/", 2**40)
+    checker.sleep = lambda seconds: None
+    return checker
+
+
+def corrupt(path):
+    stats = os.stat(path)
+    with open(path, "r+b") as f:
+        f.write(b"X")
+    os.utime(path, ns=(stats.st_atime_ns, stats.st_mtime_ns))  # Same size and mtime: the data changed without being written
+
+
+def test_mismatch_is_listed_once(scrubber, tmp_path):
+    path = tmp_path / "users" / "guest" / "file"
+    path.write_bytes(os.urandom(1000))
+    db = scrubber.connect()
+    scrubber.check_file(db, "guest/file")
+    corrupt(path)
+    for i in range(3):  # One check per pass
+        scrubber.check_file(db, "guest/file")
+    assert [path for path, detected in scrubber.read_status()["mismatches"]] == []  # Not committed yet
+    db.commit()
+    assert [path for path, detected in scrubber.read_status()["mismatches"]] == ["guest/file"]
+    path.write_bytes(b"replaced")
+    scrubber.check_file(db, "guest/file")
+    db.commit()
+    assert scrubber.read_status()["mismatches"] == []
+
+
+def test_recorded_checksum_detects_early_corruption(scrubber, tmp_path):
+    path = tmp_path / "users" / "guest" / "file"
+    data = os.urandom(1000)
+    path.write_bytes(data)
+    checksum = socket_interface.CHECKSUMS["blake2b"][1]()
+    checksum.update(data)
+    scrub.record(str(path), checksum.digest(), "blake2b")  # Calculated while the file was uploaded
+    corrupt(path)  # Before the first pass of the scrub
+    db = scrubber.connect()
+    scrubber.store_written(db)
+    scrubber.check_file(db, "guest/file")
+    db.commit()
+    assert [path for path, detected in scrubber.read_status()["mismatches"]] == ["guest/file"]
+
+
+def test_record_is_ignored_while_not_recording(scrubber, tmp_path, monkeypatch):
+    monkeypatch.setattr(scrub, "recording", False)
+    (tmp_path / "users" / "guest" / "file").write_text("x")
+    scrub.record(str(tmp_path / "users" / "guest" / "file"), b"checksum")
+    assert scrub.written == {}
@@ -0,0 +1,71 @@
+import os
+import pytest
+import socket_interface
+
+
+def test_token_round_trip():
+    token = socket_interface.issue_token("guest", 60)
+    assert socket_interface.verify_token(token, ["guest"]) == "guest"
+    assert socket_interface.verify_token(token, ["other"]) is None
+    assert socket_interface.verify_token(socket_interface.issue_token("guest", -1), ["guest"]) is None  # Expired
+
+
+def test_tampered_tokens_are_rejected():
+    token = socket_interface.issue_token("guest", 60)
+    assert socket_interface.parse_token(token.replace("guest", "admin", 1)) is None
+    assert socket_interface.parse_token(token[:-1] + "ä") is None  # Non-ASCII signatures don't raise
+    assert socket_interface.parse_token("") is None
+
+
+def test_revoked_tokens_are_rejected():
+    token = socket_interface.issue_token("guest", 60)
+    assert not socket_interface.revoke_token(token, "other")
+    assert socket_interface.revoke_token(token, "guest")
+    assert socket_interface.verify_token(token, ["guest"]) is None
+    assert socket_interface.verify_token(socket_interface.issue_token("guest", 60), ["guest"]) == "guest"
+
+
+def test_owns_path():
+    assert socket_interface.owns_path("guest/folder", "guest")
+    assert not socket_interface.owns_path("guest/../other", "guest")
+    assert not socket_interface.owns_path("guest/.trash/entry", "guest")
+    assert not socket_interface.owns_path("guestx/folder", "guest")
+
+
+@pytest.fixture
+def folder(tmp_path):
+    directory = tmp_path / "users" / "guest" / "sync"
+    directory.mkdir(parents=True)
+    for name, mtime in [("same", 1000), ("server_newer", 3000), ("client_newer", 1000), ("server_only", 1000)]:
+        (directory / name).write_text(name)
+        os.utime(directory / name, (mtime, mtime))
+    return tmp_path
+
+
+def manifest(mode):
+    return {"folder": "guest/sync", "mode": mode, "files": [["same", 4, 1000, ""], ["server_newer", 12, 2000, ""],
+                                                          ["client_newer", 12, 2000, ""], ["client_only", 1, 1000, ""]]}
+
+
+def test_plan_sync_both(folder):
+    plan = socket_interface.plan_sync(str(folder), "guest", manifest("both"), "sha384")
+    assert [entry[0] for entry in plan["download"]] == ["server_newer", "server_only"]
+    assert plan["upload"] == ["client_newer", "client_only"]
+    assert plan["extra"] == []
+
+
+def test_plan_sync_download(folder):
+    plan = socket_interface.plan_sync(str(folder), "guest", manifest("download"), "sha384")
+    assert [entry[0] for entry in plan["download"]] == ["client_newer", "server_newer", "server_only"]
+    assert plan["upload"] == [] and plan["extra"] == ["client_only"]
+
+
+def test_plan_sync_equal_checksum(folder):
+    files = [["server_newer", 12, 2000, socket_interface.calc_hash(b"server_newer", "sha384").hex()]]
+    plan = socket_interface.plan_sync(str(folder), "guest", {"folder": "guest/sync", "mode": "upload", "files": files}, "sha384")
+    assert "server_newer" not in plan["upload"]  # Different mtime, but the same content
+
+
+def test_plan_sync_rejects_paths_outside_the_folder(folder):
+    with pytest.raises(ValueError):
+        socket_interface.plan_sync(str(folder), "guest", {"folder": "guest/sync", "mode": "upload", "files": [["../../other/x", 1, 1, ""]]}, "sha384")
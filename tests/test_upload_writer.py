@@ -0,0 +1,51 @@
+import io
+import os
+import pytest
+import scrub
+import upload_writer
+
+
+@pytest.fixture
+def user_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(scrub, "written", dict())
+    return tmp_path
+
+
+def upload(user_root, name, data, **commit_args):
+    staged = upload_writer.StagedFile(str(user_root / name), str(user_root), len(data))
+    upload_writer.write_stream(staged, io.BytesIO(data).readinto, len(data))
+    staged.commit(**commit_args)
+    return staged
+
+
+def test_commit_is_atomic(user_root):
+    data = os.urandom(5 * 2**20)
+    staged = upload_writer.StagedFile(str(user_root / "file"), str(user_root), len(data))
+    upload_writer.write_stream(staged, io.BytesIO(data).readinto, len(data))
+    assert not (user_root / "file").exists()  # Invisible until committed
+    staged.commit()
+    assert (user_root / "file").read_bytes() == data
+    assert os.listdir(upload_writer.staging_path(str(user_root))) == []
+
+
+def test_existing_target_is_kept(user_root):
+    (user_root / "file").write_text("old")
+    with pytest.raises(FileExistsError):
+        upload(user_root, "file", b"new")
+    assert (user_root / "file").read_text() == "old"
+    assert os.listdir(upload_writer.staging_path(str(user_root))) == []
+    upload(user_root, "file", b"new", overwrite=True)
+    assert (user_root / "file").read_text() == "new"
+
+
+def test_mtime_is_set_before_the_checksum_is_recorded(user_root, monkeypatch):
+    monkeypatch.setattr(scrub, "recording", True)
+    upload(user_root, "file", b"data", mtime_ns=1600000000123456789)
+    assert os.stat(user_root / "file").st_mtime_ns == 1600000000123456789
+    size, mtime_ns, checksum, algorithm = scrub.written[str(user_root / "file")]
+    assert (size, mtime_ns, algorithm) == (4, 1600000000123456789, scrub.CHECKSUM)
+
+
+def test_no_extra_checksum_while_the_scrub_is_off(user_root, monkeypatch):
+    monkeypatch.setattr(scrub, "recording", False)
+    assert upload(user_root, "file", b"data").checksum is None
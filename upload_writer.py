@@ -0,0 +1,201 @@
+# This file contains the crash-safe upload pipeline: staged, preallocated files that are written behind and committed atomically.
+# Copyright (C) 2023  Nico Pieplow (nitrescov)
+# Contact: nitrescov@protonmail.com
+
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import errno
+import shutil
+import secrets
+import threading
+import scrub
+import buffer_pool
+import file_operations
+
+# Constants
+STAGING_DIR = ".staging"  # Inside the trash folder of each user: hidden, but on the same file system as the user files
+GROUP_INTERVAL = 0.2  # Seconds the group commit collects finished uploads before they are flushed together
+
+POOL = None  # Native threads, so that writes and fsyncs don't stall the gevent hub
+MODE = "file"  # "file": every upload is flushed on its own, "group": finished uploads are flushed in batches
+GROUP = list()  # Uploads waiting for the next group commit
+
+
+def configure(mode: str = "file", workers: int = 4) -> None:
+    global POOL, MODE
+    from gevent.threadpool import ThreadPool  # Imported here, so that the gevent monkey patching happened before
+    POOL = ThreadPool(workers)
+    MODE = mode
+    if mode == "group":
+        threading.Thread(target=group_committer, daemon=True).start()
+
+
+def staging_path(user_root: str) -> str:
+    return os.path.join(user_root, file_operations.TRASH_DIR, STAGING_DIR)
+
+
+def clean_staging(user_root: str) -> None:
+    # Removes the remains of uploads interrupted by a crash (only called at startup)
+    shutil.rmtree(staging_path(user_root), ignore_errors=True)
+
+
+class StagedFile:
+    def __init__(self, target: str, user_root: str, length: int, checksum=None, algorithm: str = scrub.CHECKSUM):
+        if POOL is None:
+            configure()
+        os.makedirs(staging_path(user_root), exist_ok=True)
+        self.target = target
+        self.staging = os.path.join(staging_path(user_root), secrets.token_hex(8))
+        self.fd = os.open(self.staging, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        self.offset = 0
+        self.pending = None
+        self.error = None
+        # Checksum for the integrity scrub: the one the caller calculates anyway (with its algorithm), otherwise it is calculated
+        # by the write-behind thread, but only while the scrub collects them
+        self.own_checksum = checksum is None and scrub.recording
+        self.checksum = scrub.ALGORITHMS[scrub.CHECKSUM]() if self.own_checksum else checksum
+        self.algorithm = scrub.CHECKSUM if self.own_checksum else algorithm
+        if length > 0 and hasattr(os, "posix_fallocate"):
+            try:  # Reserves the whole file at once (contiguous on the disk, a full disk is detected before receiving the data)
+                os.posix_fallocate(self.fd, 0, length)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    self.discard()
+                    raise
+                # Other errors: the file system does not support preallocation
+
+    def write(self, data) -> None:
+        # Hands the data to the write-behind thread, the caller may only reuse the buffer after the next call of write()
+        self.wait()
+        self.pending = POOL.spawn(write_all, self.fd, data, self.offset, self.checksum if self.own_checksum else None)
+        self.offset += len(data)
+
+    def wait(self) -> None:
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.get()
+
+    def commit(self, overwrite: bool = False, mtime_ns: int | None = None) -> None:
+        # Returns after the file is durable under its final name (the staging file is never visible to the users)
+        self.wait()
+        os.ftruncate(self.fd, self.offset)  # Removes unused preallocated space
+        if mtime_ns is not None:  # Set before the commit, so that the file never appears (or is recorded) with another time
+            os.utime(self.fd, ns=(mtime_ns, mtime_ns))
+        if not overwrite and os.path.lexists(self.target):
+            self.discard()
+            raise FileExistsError(errno.EEXIST, "Target already exists", self.target)
+        if MODE == "group":
+            done = threading.Event()
+            GROUP.append((self, done))
+            done.wait()
+        else:
+            POOL.spawn(flush_files, [self]).get()
+        if self.error:
+            self.discard()
+            raise self.error
+        if self.checksum is not None:
+            scrub.record(self.target, self.checksum.digest(), self.algorithm)
+
+    def discard(self) -> None:
+        try:
+            self.wait()
+        except OSError:
+            pass
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if os.path.exists(self.staging):
+            os.remove(self.staging)
+
+
+def write_all(fd: int, data, offset: int, checksum=None) -> None:
+    if checksum is not None:
+        checksum.update(data)
+    while data:
+        written = os.pwrite(fd, data, offset)
+        data = data[written:]
+        offset += written
+
+
+def write_stream(staged: StagedFile | None, read_into, length: int, hash_object=None) -> None:
+    # Copies length bytes from read_into (readinto or recv_into of the source) to the staged file (None: the data is dropped).
+    # Two pooled buffers are used alternately: one is filled completely while the other one is written.
+    with buffer_pool.buffers(2) as file_buffers:
+        remaining = length
+        counter = 0
+        try:
+            while remaining:
+                file_buffer = file_buffers[counter % len(file_buffers)]
+                counter += 1
+                if staged and len(file_buffers) == 1:
+                    staged.wait()  # Only one buffer available, it must be written before it is filled again
+                filled = 0
+                while filled < len(file_buffer) and remaining:
+                    buffer_len = read_into(file_buffer[filled:filled + min(len(file_buffer) - filled, remaining)])
+                    if not buffer_len:
+                        raise ConnectionError("Upload interrupted")
+                    filled += buffer_len
+                    remaining -= buffer_len
+                if hash_object is not None:
+                    hash_object.update(file_buffer[:filled])
+                if staged:
+                    staged.write(file_buffer[:filled])
+        finally:
+            if staged:
+                staged.wait()  # The buffers are only returned to the pool after the last write finished
+
+
+def flush_files(files: list[StagedFile]) -> None:
+    # Runs in a native thread: data first, then the atomic renames, then the folders (one fsync per folder for the whole batch)
+    for staged in files:
+        try:
+            os.fsync(staged.fd)
+        except OSError as e:
+            staged.error = e
+    directories = set()
+    for staged in files:
+        if staged.error:
+            continue
+        try:
+            os.close(staged.fd)
+            staged.fd = None
+            os.rename(staged.staging, staged.target)
+            directories.add(os.path.dirname(staged.target))
+        except OSError as e:
+            staged.error = e
+    for directory in directories:
+        try:
+            directory_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+        except OSError:
+            pass  # The files are complete in any case, at worst a rename is lost with a crash
+
+
+def group_committer() -> None:
+    while True:
+        time.sleep(GROUP_INTERVAL)
+        if not GROUP:
+            continue
+        batch = GROUP[:]
+        del GROUP[:len(batch)]
+        try:
+            POOL.spawn(flush_files, [staged for staged, done in batch]).get()
+        except Exception as e:
+            for staged, done in batch:
+                staged.error = staged.error or e
+        for staged, done in batch:
+            done.set()